@@ -0,0 +1,170 @@
+import re
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Dict, Iterable, Tuple
+from urllib.parse import urlsplit
+
+
+# Public suffixes with two labels, so "example.co.uk" stays "example.co.uk"
+MULTI_PART_SUFFIXES = {
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "com.au", "net.au", "org.au",
+    "co.nz", "co.jp", "co.in", "co.kr", "com.br", "com.cn", "com.mx", "co.za",
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+DOMAIN_PATTERN = re.compile(r"\b(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z]{2,}\b")
+
+# Fuzzy matching limits: only brand tokens at least this long are fuzzy
+# matched, and each tool name gets at most this many similarity checks
+FUZZY_MIN_LENGTH = 5
+FUZZY_CUTOFF = 0.85
+MAX_FUZZY_CHECKS = 50
+FUZZY_CACHE_SIZE = 10000
+
+
+def registrable_domain(value: str) -> str:
+    """
+    Normalize a URL or host to its registrable domain.
+
+    "https://www.neon.tech/docs" and "console.neon.tech" both become
+    "neon.tech".
+    """
+    value = value.strip().lower()
+    if not value:
+        return ""
+    host = urlsplit(value if "//" in value else "//" + value).hostname or ""
+    labels = [label for label in host.split(".") if label]
+    if len(labels) >= 3 and ".".join(labels[-2:]) in MULTI_PART_SUFFIXES:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def _is_inner_edit(token: str, target: str) -> bool:
+    """
+    True if one string is the other with a single character inserted
+    before its last letter.
+
+    Edits at the end are left out on purpose: that is where plurals and
+    tenses (-s, -ed, -ing) and truncations like "prism" for "Prisma" live.
+    """
+    shorter, longer = sorted((token, target), key=len)
+    if len(longer) - len(shorter) != 1 or longer.startswith(shorter):
+        return False
+    for i, char in enumerate(shorter):
+        if char != longer[i]:
+            return longer[i + 1:] == shorter[i:]
+    return False
+
+
+class AliasIndex:
+    """
+    Lookup index for every way a brand can show up in a response.
+
+    Built once per run from the tracked domain, the brand name and any
+    extra aliases. Aliases with a dot are treated as domains, everything
+    else as whole-word brand phrases, so "Neon" matches "Neon Postgres"
+    but not "neonatal". Single-word brand tokens also get a bounded fuzzy
+    fallback for near-miss spellings, used only on tool names since free
+    text is full of ordinary words a letter away from a brand.
+    """
+
+    def __init__(self, domain: str, brand_name: str, aliases: Iterable[str] = ()):
+        self.domains = set()
+        self.phrases = set()
+        self.phrase_lengths = set()
+
+        for alias in (domain, brand_name, *aliases):
+            if not alias:
+                continue
+            if "." in alias:
+                self.domains.add(registrable_domain(alias))
+            else:
+                self._add_phrase(alias)
+
+        # The domain's own name is a brand token too ("neon" for neon.tech)
+        for registered in list(self.domains):
+            self._add_phrase(registered.split(".")[0])
+
+        self._fuzzy_targets = [phrase[0] for phrase in self.phrases
+                               if len(phrase) == 1 and len(phrase[0]) >= FUZZY_MIN_LENGTH]
+        self._fuzzy_initials = {target[0] for target in self._fuzzy_targets}
+        self._fuzzy_cache: Dict[str, bool] = {}
+
+    def _add_phrase(self, text: str):
+        phrase = tuple(TOKEN_PATTERN.findall(text.lower()))
+        if phrase:
+            self.phrases.add(phrase)
+            self.phrase_lengths.add(len(phrase))
+
+    def _fuzzy_match(self, token: str) -> bool:
+        cached = self._fuzzy_cache.get(token)
+        if cached is not None:
+            return cached
+
+        matched = False
+        for target in self._fuzzy_targets:
+            if token[0] != target[0]:
+                continue
+            if len(token) == len(target):
+                if SequenceMatcher(None, token, target).ratio() >= FUZZY_CUTOFF:
+                    matched = True
+                    break
+            elif _is_inner_edit(token, target):
+                matched = True
+                break
+
+        if len(self._fuzzy_cache) >= FUZZY_CACHE_SIZE:
+            self._fuzzy_cache.clear()
+        self._fuzzy_cache[token] = matched
+        return matched
+
+    def matches_domain(self, text: str) -> bool:
+        """True if the text contains a URL or host on one of the brand's domains."""
+        if not text or not self.domains:
+            return False
+        for host in DOMAIN_PATTERN.findall(text.lower()):
+            if registrable_domain(host) in self.domains:
+                return True
+        return False
+
+    def matches_name(self, text: str, fuzzy: bool = False) -> bool:
+        """
+        True if the text contains one of the brand phrases as whole words.
+
+        With fuzzy, single tokens one typo away from a brand token also
+        match. Only use it on short, name-like text such as tool names.
+        """
+        if not text:
+            return False
+        tokens = TOKEN_PATTERN.findall(text.lower())
+
+        for i in range(len(tokens)):
+            for length in self.phrase_lengths:
+                if tuple(tokens[i:i + length]) in self.phrases:
+                    return True
+
+        if fuzzy and self._fuzzy_targets:
+            checks = 0
+            for token in tokens:
+                if len(token) < FUZZY_MIN_LENGTH - 1 or token[0] not in self._fuzzy_initials:
+                    continue
+                checks += 1
+                if checks > MAX_FUZZY_CHECKS:
+                    break
+                if self._fuzzy_match(token):
+                    return True
+        return False
+
+    def matches(self, text: str, fuzzy: bool = False) -> bool:
+        """True if the text mentions the brand by domain or by name. See matches_name for fuzzy."""
+        return self.matches_domain(text) or self.matches_name(text, fuzzy)
+
+
+@lru_cache(maxsize=64)
+def _cached_index(domain: str, brand_name: str, aliases: Tuple[str, ...]) -> AliasIndex:
+    return AliasIndex(domain, brand_name, aliases)
+
+
+def get_alias_index(domain: str, brand_name: str, aliases: Iterable[str] = ()) -> AliasIndex:
+    """Return a shared AliasIndex for a domain/brand/aliases combination."""
+    return _cached_index(domain, brand_name, tuple(aliases))
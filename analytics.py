@@ -0,0 +1,162 @@
+from dataclasses import dataclass
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from records import MentionStatus, as_result, prompt_keyword
+
+
+# Axis order of every RankTensor array
+AXES = ("keyword", "provider", "prompt")
+
+# Label used for prompts that don't carry a keyword
+UNKNOWN_KEYWORD = "(unknown)"
+
+# Results that don't count as answers when computing rates
+UNANSWERED_STATUSES = frozenset({MentionStatus.ERROR, MentionStatus.SKIPPED})
+
+
+@dataclass(slots=True)
+class RankTensor:
+    """
+    Dense keyword x provider x prompt view of a run's results.
+
+    Prompts are laid out in slots per keyword, so the prompt axis is as
+    long as the keyword with the most prompts. Slots without a result are
+    masked out through `valid`.
+    """
+    keywords: List[str]
+    providers: List[str]
+    ranks: np.ndarray  # 1-based position, 0 when not ranked
+    mentioned: np.ndarray  # bool, domain/brand mentioned at all
+    valid: np.ndarray  # bool, slot holds an answered query
+
+    @property
+    def shape(self):
+        return self.ranks.shape
+
+
+def build_rank_tensor(rankings: Dict[str, Dict[str, object]], keywords: Sequence[str] = None) -> RankTensor:
+    """
+    Build a RankTensor from results[llm][prompt].
+
+    Args:
+        rankings: Dictionary with ranking results by LLM and prompt. The
+            keyword comes from each result's `keyword`, falling back to
+            the records.Prompt key
+        keywords: Optional keyword order; keywords found on the prompts but
+            missing here are appended
+
+    Returns:
+        RankTensor covering every provider and keyword
+    """
+    providers = list(rankings)
+    keyword_order = list(keywords or ())
+    keyword_index = {keyword: i for i, keyword in enumerate(keyword_order)}
+    slot_index = {}  # (keyword, prompt) -> (keyword index, slot)
+    slots_used = []
+
+    # One pass to flatten everything into index/value columns
+    k_idx, p_idx, s_idx, rank_values, mentioned_values = [], [], [], [], []
+    for provider_i, provider in enumerate(providers):
+        for prompt, data in rankings[provider].items():
+            result = as_result(data)
+            if result.status in UNANSWERED_STATUSES:
+                continue
+
+            keyword = result.keyword or prompt_keyword(prompt) or UNKNOWN_KEYWORD
+            key = (keyword, str(prompt))
+            if key not in slot_index:
+                if keyword not in keyword_index:
+                    keyword_index[keyword] = len(keyword_order)
+                    keyword_order.append(keyword)
+                keyword_i = keyword_index[keyword]
+                while len(slots_used) <= keyword_i:
+                    slots_used.append(0)
+                slot_index[key] = (keyword_i, slots_used[keyword_i])
+                slots_used[keyword_i] += 1
+
+            keyword_i, slot = slot_index[key]
+            k_idx.append(keyword_i)
+            p_idx.append(provider_i)
+            s_idx.append(slot)
+            rank_values.append(result.position if result.status is MentionStatus.RANKED else 0)
+            mentioned_values.append(result.is_mentioned)
+
+    shape = (len(keyword_order), len(providers), max(slots_used, default=0))
+    ranks = np.zeros(shape, dtype=np.int32)
+    mentioned = np.zeros(shape, dtype=bool)
+    valid = np.zeros(shape, dtype=bool)
+    if k_idx:
+        index = (np.asarray(k_idx), np.asarray(p_idx), np.asarray(s_idx))
+        ranks[index] = rank_values
+        mentioned[index] = mentioned_values
+        valid[index] = True
+
+    return RankTensor(keyword_order, providers, ranks, mentioned, valid)
+
+
+def _reduce(values: np.ndarray, valid: np.ndarray, by: Sequence[str]) -> np.ndarray:
+    """Mean of values over the valid slots, keeping the `by` axes."""
+    unknown = set(by) - set(AXES)
+    if unknown:
+        raise ValueError(f"Unknown axes {sorted(unknown)}, expected some of {AXES}")
+    reduce_axes = tuple(i for i, axis in enumerate(AXES) if axis not in by)
+    totals = np.where(valid, values, 0).sum(axis=reduce_axes)
+    counts = valid.sum(axis=reduce_axes)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(counts > 0, totals / counts, np.nan)
+
+
+def mention_rate(tensor: RankTensor, by: Sequence[str] = ("provider",)) -> np.ndarray:
+    """
+    Share of answered queries mentioning the domain/brand.
+
+    Args:
+        tensor: RankTensor to aggregate
+        by: Axes to keep, out of AXES. The result keeps them in AXES order
+            and averages over the rest; NaN where nothing was answered.
+    """
+    return _reduce(tensor.mentioned, tensor.valid, by)
+
+
+def mean_reciprocal_rank(tensor: RankTensor, by: Sequence[str] = ("provider",)) -> np.ndarray:
+    """Mean of 1/rank over answered queries, counting unranked as 0. See mention_rate for `by`."""
+    reciprocal = np.divide(1.0, tensor.ranks, out=np.zeros(tensor.shape), where=tensor.ranks > 0)
+    return _reduce(reciprocal, tensor.valid, by)
+
+
+def top_k_rate(tensor: RankTensor, k: int = 3, by: Sequence[str] = ("provider",)) -> np.ndarray:
+    """Share of answered queries ranking the domain in the top k. See mention_rate for `by`."""
+    return _reduce((tensor.ranks > 0) & (tensor.ranks <= k), tensor.valid, by)
+
+
+def answered_counts(tensor: RankTensor, by: Sequence[str] = ("provider",)) -> np.ndarray:
+    """Number of answered queries, keeping the `by` axes."""
+    return tensor.valid.sum(axis=tuple(i for i, axis in enumerate(AXES) if axis not in by))
+
+
+def keyword_table(tensor: RankTensor, k: int = 3) -> List[Dict[str, object]]:
+    """
+    Per-keyword rates across all providers, best mention rate first.
+
+    Returns:
+        List of {"keyword", "queries", "mention_rate", "mrr", "top_rate"}
+        dicts, rates in percent
+    """
+    by = ("keyword",)
+    mentions = mention_rate(tensor, by) * 100
+    mrr = mean_reciprocal_rank(tensor, by)
+    top = top_k_rate(tensor, k, by) * 100
+    counts = answered_counts(tensor, by)
+    order = np.argsort(-np.nan_to_num(mentions, nan=-1.0), kind="stable")
+    return [
+        {
+            "keyword": tensor.keywords[i],
+            "queries": int(counts[i]),
+            "mention_rate": round(float(mentions[i]), 1) if counts[i] else None,
+            "mrr": round(float(mrr[i]), 3) if counts[i] else None,
+            "top_rate": round(float(top[i]), 1) if counts[i] else None,
+        }
+        for i in order
+    ]
@@ -0,0 +1,404 @@
+import argparse
+import glob
+import gzip
+import itertools
+import json
+import mmap
+import os
+import struct
+import zlib
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on Windows; a single writer per archive is safe there
+    fcntl = None
+
+from packed import unpack_packed_response
+from ranking import build_result_entry, get_parser
+from aliases import get_alias_index
+
+
+# Each index entry is (offset, length) of one compressed frame in the archive
+INDEX_ENTRY = struct.Struct("<QI")
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Default archive location, named after the compression actually used
+DEFAULT_ARCHIVE = "llm_responses.jsonl.zst" if zstandard is not None else "llm_responses.jsonl.gz"
+
+# Bytes fed to a decompressor at a time while scanning for frame boundaries
+SCAN_CHUNK_SIZE = 64 * 1024
+
+# Records handed to each worker process at a time when re-ranking
+RERANK_CHUNK_SIZE = 256
+
+
+def _compress(data: bytes) -> bytes:
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data)
+
+
+def _decompress(frame: bytes) -> bytes:
+    if frame.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("Archive contains zstd frames, install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(frame)
+    return gzip.decompress(frame)
+
+
+def _archive_name(path: str) -> str:
+    """The file an archive at path is actually written to, .gz instead of .zst without zstandard."""
+    if zstandard is None and path.endswith(".zst"):
+        return path[:-len(".zst")] + ".gz"
+    return path
+
+
+def shard_path(path: str, shard: str) -> str:
+    """Path of a named shard of an archive, e.g. llm_responses.jsonl.<shard>.zst."""
+    root, ext = os.path.splitext(_archive_name(path))
+    return f"{root}.{shard}{ext}"
+
+
+def archive_paths(paths: Union[str, Iterable[str]]) -> List[str]:
+    """
+    Expand archive paths and glob patterns into the archive files that exist.
+
+    A plain path also picks up the shards written next to it by
+    workqueue.start_workers.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    found = []
+    for path in paths:
+        if any(char in path for char in "*?["):
+            matches = sorted(glob.glob(path))
+        else:
+            path = _archive_name(path)
+            root, ext = os.path.splitext(path)
+            matches = [path] + sorted(glob.glob(f"{glob.escape(root)}.*{glob.escape(ext)}"))
+        for match in matches:
+            if match not in found and not match.endswith(".idx") and os.path.isfile(match):
+                found.append(match)
+    return found
+
+
+def _lock(f):
+    """Take an exclusive lock on an open archive, released when the file is closed."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def _decompressobj(frame_start: bytes):
+    if frame_start.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("Archive contains zstd frames, install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(wbits=31)
+
+
+class ResponseArchive:
+    """
+    Append-only archive of full raw LLM responses.
+
+    Every record is one JSON line compressed into its own zstd frame (gzip
+    member when zstandard isn't installed), so the file can be read with
+    plain `zstdcat`/`zcat` as well as randomly accessed through a sidecar
+    index of (offset, length) entries. Writers lock the archive file, so
+    several processes can append to the same archive.
+    """
+
+    def __init__(self, path: str):
+        if _archive_name(path) != path:
+            path = _archive_name(path)
+            print(f"zstandard is not installed, archiving gzip members to {path} instead")
+        self.path = path
+        self.index_path = path + ".idx"
+        self._index: List[tuple] = []
+        self._index_stat = None
+        if os.path.exists(self.path) and not self._index_is_current():
+            self.rebuild_index()
+
+    def _index_is_current(self) -> bool:
+        if not os.path.exists(self.index_path):
+            return False
+        entries = self._entries()
+        archive_size = os.path.getsize(self.path)
+        if not entries:
+            return archive_size == 0
+        offset, length = entries[-1]
+        return offset + length == archive_size
+
+    def _entries(self) -> List[tuple]:
+        """The index entries, re-read only when the index file has changed since the last read."""
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            self._index, self._index_stat = [], None
+            return self._index
+        if (stat.st_size, stat.st_mtime_ns) != self._index_stat:
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            self._index = [entry for entry in INDEX_ENTRY.iter_unpack(data[:usable])]
+            self._index_stat = (stat.st_size, stat.st_mtime_ns)
+        return self._index
+
+    def rebuild_index(self):
+        """Rebuild the offset index by scanning the archive frame by frame."""
+        entries = []
+        with open(self.path, "rb") as f:
+            # Hold off writers so no frame is appended without its index entry
+            _lock(f)
+            if os.fstat(f.fileno()).st_size > 0:
+                # Map the file rather than reading it, and feed each frame to
+                # its decompressor in bounded chunks; the frame ends where the
+                # decompressor reports unused data
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    view = memoryview(data)
+                    try:
+                        entries = self._scan_frames(view)
+                    finally:
+                        view.release()
+
+            with open(self.index_path, "wb") as index:
+                for entry in entries:
+                    index.write(INDEX_ENTRY.pack(*entry))
+
+    def _scan_frames(self, data: memoryview) -> List[tuple]:
+        entries = []
+        offset = 0
+        while offset < len(data):
+            decompressor = _decompressobj(bytes(data[offset:offset + 4]))
+            pos = offset
+            try:
+                while not decompressor.eof and pos < len(data):
+                    chunk = data[pos:pos + SCAN_CHUNK_SIZE]
+                    decompressor.decompress(chunk)
+                    pos += len(chunk)
+            except Exception as e:
+                print(f"Archive {self.path} is truncated at byte {offset}: {str(e)}")
+                break
+            if not decompressor.eof:
+                print(f"Archive {self.path} ends with a partial frame at byte {offset}")
+                break
+            end = pos - len(decompressor.unused_data)
+            entries.append((offset, end - offset))
+            offset = end
+        return entries
+
+    def append(self, record: Dict[str, Any]):
+        """Compress a record into a new frame at the end of the archive."""
+        frame = _compress((json.dumps(record) + "\n").encode("utf-8"))
+        with open(self.path, "ab") as f:
+            # Other processes may share the archive, so the offset has to be
+            # taken under the lock and the index entry written before it's released
+            _lock(f)
+            offset = f.seek(0, os.SEEK_END)
+            f.write(frame)
+            f.flush()
+            with open(self.index_path, "ab") as index:
+                index.write(INDEX_ENTRY.pack(offset, len(frame)))
+
+    def _read_frames(self, entries: List[tuple]) -> Iterator[Dict[str, Any]]:
+        if not entries or not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for offset, length in entries:
+                f.seek(offset)
+                try:
+                    record = json.loads(_decompress(f.read(length)))
+                except Exception as e:
+                    print(f"Skipping unreadable frame at byte {offset} of {self.path}: {str(e)}")
+                    continue
+                yield record
+
+    def __len__(self) -> int:
+        return len(self._entries())
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+        if isinstance(i, slice):
+            return list(self._read_frames(self._entries()[i]))
+        records = list(self._read_frames([self._entries()[i]]))
+        if not records:
+            raise ValueError(f"Record {i} of {self.path} is unreadable")
+        return records[0]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self._read_frames(list(self._entries()))
+
+
+def make_record(llm_name, prompts, raw_response, packed=False, structured=False, domain=None,
+                latency=None, input_tokens=None, output_tokens=None):
+    """Build the archive record for one provider call, with its timing and token usage."""
+    return {
+        "ts": datetime.now().isoformat(),
+        "domain": domain,
+        "llm": llm_name,
+        "prompts": list(prompts),
+        "packed": packed,
+        "structured": structured,
+        "response": raw_response,
+        "latency": latency,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+    }
+
+
+def rerank_record(record: Dict[str, Any], targets: List[tuple]) -> List[Dict[str, Any]]:
+    """
+    Re-parse one archived response and rank every target in it.
+
+    Args:
+        record: Archive record from make_record
+        targets: List of (domain, brand_name) tuples to rank
+
+    Returns:
+        One row per (prompt, target) with the recomputed rank
+    """
+    llm_name = record["llm"]
+    raw_response = record["response"]
+
+    if record.get("packed"):
+        tools_by_prompt = unpack_packed_response(raw_response, record["prompts"])
+    else:
+        parser_func = get_parser(llm_name, record.get("structured", False))
+        try:
+            tools_by_prompt = {record["prompts"][0]: parser_func(raw_response)}
+        except Exception as e:
+            print(f"Error parsing archived {llm_name} response: {str(e)}")
+            tools_by_prompt = {record["prompts"][0]: []}
+
+    rows = []
+    for prompt, tools in tools_by_prompt.items():
+        # Packed answers that failed validation were re-asked in their own call
+        if tools is None:
+            continue
+        for target_domain, brand_name in targets:
+            entry = build_result_entry(raw_response, tools, target_domain, brand_name,
+                                       get_alias_index(target_domain, brand_name))
+            rows.append({
+                "ts": record.get("ts"),
+                "llm": llm_name,
+                "prompt": prompt,
+                "domain": target_domain,
+                "brand": brand_name,
+                "rank": entry.rank,
+                "parsed_tools_count": entry.parsed_tools_count,
+            })
+    return rows
+
+
+def _rerank_chunk(args):
+    records, targets = args
+    rows = []
+    for record in records:
+        rows.extend(rerank_record(record, targets))
+    return rows
+
+
+def _chunks(records: Iterator[Dict[str, Any]], targets: List[tuple], size: int):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk, targets
+            chunk = []
+    if chunk:
+        yield chunk, targets
+
+
+def rerank_archive(paths: Union[str, Iterable[str]], targets: List[tuple], workers: int = None,
+                   chunk_size: int = RERANK_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Stream archives through the current parsers and find_rank_in_tools.
+
+    Args:
+        paths: Archive file, glob pattern or list of them; worker shards
+            next to a plain path are included (see archive_paths)
+        targets: List of (domain, brand_name) tuples to rank
+        workers: Number of worker processes, defaults to the CPU count
+        chunk_size: Records sent to a worker at a time
+
+    Yields:
+        Re-ranked rows, archive by archive in archive order
+    """
+    records = itertools.chain.from_iterable(ResponseArchive(path) for path in archive_paths(paths))
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Only keep a couple of chunks per worker in flight so memory stays
+        # bounded no matter how big the archive is
+        in_flight = deque()
+        for chunk in _chunks(records, targets, chunk_size):
+            in_flight.append(pool.submit(_rerank_chunk, chunk))
+            if len(in_flight) >= workers * 2:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def summarize_rerank(rows: Iterator[Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Mention and top-3 rates per brand and LLM from re-ranked rows."""
+    counts = defaultdict(lambda: defaultdict(lambda: {"total": 0, "mentioned": 0, "top_ranked": 0}))
+    for row in rows:
+        stats = counts[row["brand"]][row["llm"]]
+        rank = row["rank"]
+        stats["total"] += 1
+        if "Not mentioned" not in str(rank) and "Error" not in str(rank):
+            stats["mentioned"] += 1
+        if isinstance(rank, int) and rank <= 3:
+            stats["top_ranked"] += 1
+
+    summary = {}
+    for brand, by_llm in counts.items():
+        summary[brand] = {}
+        for llm_name, stats in by_llm.items():
+            total = stats["total"]
+            summary[brand][llm_name] = {
+                **stats,
+                "mention_rate": round(stats["mentioned"] / total * 100, 1) if total > 0 else 0,
+                "top_rate": round(stats["top_ranked"] / total * 100, 1) if total > 0 else 0,
+            }
+    return summary
+
+
+def _parse_target(value):
+    """Parse a BRAND=DOMAIN command line target."""
+    if "=" not in value:
+        raise argparse.ArgumentTypeError("targets must look like BRAND=DOMAIN")
+    brand_name, target_domain = value.split("=", 1)
+    return target_domain, brand_name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-rank archived LLM responses offline.")
+    parser.add_argument("archive", help="Path to the response archive (worker shards next to it are included) "
+                                        "or a quoted glob pattern")
+    parser.add_argument("targets", nargs="+", type=_parse_target,
+                        help="Brands to rank, as BRAND=DOMAIN (e.g. Neon=neon.tech)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--output", default=None, help="Write re-ranked rows to this JSONL file")
+    args = parser.parse_args()
+
+    def collect():
+        out = open(args.output, "w") if args.output else None
+        try:
+            for row in rerank_archive(args.archive, args.targets, workers=args.workers):
+                if out:
+                    out.write(json.dumps(row) + "\n")
+                yield row
+        finally:
+            if out:
+                out.close()
+
+    print(json.dumps(summarize_rerank(collect()), indent=2))
@@ -0,0 +1,382 @@
+import argparse
+import asyncio
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+import tokens
+from archive import ResponseArchive
+
+
+# Functions a cassette records and replays, as (module, name)
+RECORDED_FUNCTIONS = [
+    ("crawl", "scrape_website"),
+    ("llms", "call_openai"),
+    ("llms", "call_claude"),
+    ("llms", "call_perplexity"),
+]
+
+# Modules that import those functions by name and need patching too
+PATCHED_MODULES = ["__main__", "main", "crawl", "llms", "summary", "ranking", "workqueue"]
+
+# Arguments of main.main stored with each recorded run so it can be replayed
+RUN_OPTIONS = ["max_pages", "pack_size", "structured", "aliases", "top_k", "prompts_per_keyword",
+               "deadline_seconds"]
+
+# TPM budget of the schedulers used while replaying. Replayed calls cost
+# nothing, so they shouldn't wait on (or use up) the live budget
+REPLAY_TPM_LIMIT = sys.maxsize
+
+# A benchmark run this much slower than its baseline counts as a regression
+MAX_SLOWDOWN = 0.20
+
+
+class CassetteMiss(KeyError):
+    """Raised in replay mode for a scrape the cassette has no recording of."""
+
+
+def request_key(name: str, args: tuple, kwargs: Dict[str, Any]) -> str:
+    """Stable fingerprint of a call's function name and arguments."""
+    payload = json.dumps({"name": name, "args": args, "kwargs": kwargs}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _to_jsonable(value: Any) -> Any:
+    """Turn a recorded return value (e.g. a Firecrawl response object) into JSON data."""
+    if value is None or isinstance(value, (str, int, float, bool, list, dict)):
+        return value
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if hasattr(value, "markdown"):
+        return {"markdown": value.markdown}
+    return str(value)
+
+
+class Cassette:
+    """
+    Record/replay layer for the crawl and provider calls.
+
+    In record mode every scrape_website/call_* request and its response
+    (or error) and latency is appended to a cassette, a ResponseArchive
+    file. In replay mode the same calls are answered from the cassette
+    with no network, either at their recorded latency or instantly, and
+    ranking runs against unlimited TPM schedulers instead of the shared
+    ones from tokens.get_scheduler. A provider call the cassette has no
+    recording of is counted in `misses` and answered with an "Error: ..."
+    string, the same way the real call_* functions report failures.
+
+    Use as a context manager; the functions are patched in every module
+    that imports them and restored on exit:
+
+        with Cassette("run.cassette.zst", mode="record"):
+            asyncio.run(main.main("neosync.dev"))
+    """
+
+    def __init__(self, path: str, mode: str = "replay", latency: str = "recorded"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode {mode}")
+        if latency not in ("recorded", "zero"):
+            raise ValueError(f"Unknown replay latency {latency}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.archive = ResponseArchive(path)
+        self.lock = threading.Lock()
+        self.misses = 0
+        self._patches = []
+        self._brief_cache = None
+
+        # Calls with identical arguments replay in the order they were recorded
+        self.calls: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+        self.runs: List[Dict[str, Any]] = []
+        self.outcomes: Dict[int, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            for record in self.archive:
+                if record["kind"] == "call":
+                    self.calls.setdefault(record["key"], []).append(record)
+                elif record["kind"] == "run":
+                    self.runs.append(record)
+                elif record["kind"] == "outcome":
+                    self.outcomes[record["run"]] = record
+
+    def _append(self, record: Dict[str, Any]):
+        # Provider calls run in worker threads
+        with self.lock:
+            self.archive.append(record)
+
+    def wrap(self, name: str, func: Callable) -> Callable:
+        """Return the recording or replaying stand-in for a function."""
+
+        @functools.wraps(func)
+        def recorder(*args, **kwargs):
+            key = request_key(name, args, kwargs)
+            start = time.perf_counter()
+            try:
+                response = func(*args, **kwargs)
+            except Exception as e:
+                self._append({"kind": "call", "name": name, "key": key, "response": None, "error": str(e),
+                              "latency": time.perf_counter() - start})
+                raise
+            self._append({"kind": "call", "name": name, "key": key, "response": _to_jsonable(response),
+                          "error": None, "latency": time.perf_counter() - start})
+            return response
+
+        @functools.wraps(func)
+        def replayer(*args, **kwargs):
+            key = request_key(name, args, kwargs)
+            with self.lock:
+                recordings = self.calls.get(key)
+                if not recordings:
+                    self.misses += 1
+                    message = f"No recording of {name} for this request in {self.path}"
+                    if name.startswith("call_"):
+                        print(message)
+                        return f"Error: {message}"
+                    raise CassetteMiss(message)
+                i = self._cursor.get(key, 0)
+                self._cursor[key] = i + 1
+                record = recordings[min(i, len(recordings) - 1)]
+            if self.latency == "recorded":
+                time.sleep(record["latency"])
+            if record["error"] is not None:
+                raise RuntimeError(record["error"])
+            return record["response"]
+
+        return recorder if self.mode == "record" else replayer
+
+    def __enter__(self) -> "Cassette":
+        # Stand-ins keyed by id() of the function they replace
+        stand_ins = {}
+        for module_name, name in RECORDED_FUNCTIONS:
+            module = sys.modules.get(module_name) or __import__(module_name)
+            func = getattr(module, name)
+            stand_ins[id(func)] = self.wrap(name, func)
+
+        if self.mode == "replay":
+            replay_schedulers = {}
+
+            def get_replay_scheduler(provider):
+                if provider not in replay_schedulers:
+                    replay_schedulers[provider] = tokens.TPMScheduler(REPLAY_TPM_LIMIT)
+                return replay_schedulers[provider]
+
+            stand_ins[id(tokens.get_scheduler)] = get_replay_scheduler
+
+        for module_name in PATCHED_MODULES + ["tokens"]:
+            module = sys.modules.get(module_name)
+            if module is None:
+                continue
+            for attr, value in list(vars(module).items()):
+                if id(value) in stand_ins:
+                    self._patches.append((module, attr, value))
+                    setattr(module, attr, stand_ins[id(value)])
+
+        # The provider registries hold their own references to the callers
+        ranking = sys.modules.get("ranking")
+        if ranking is not None:
+            registries = [(ranking.CALLERS, list(ranking.CALLERS))]
+            registries += [(config, ["caller"]) for config in ranking.LLMS.values()]
+            for registry, keys in registries:
+                for key in keys:
+                    if id(registry[key]) in stand_ins:
+                        self._patches.append((registry, key, registry[key]))
+                        registry[key] = stand_ins[id(registry[key])]
+
+        # A cached site brief would skip the summary call, so use a fresh
+        # brief cache for the duration
+        self._brief_cache = tempfile.TemporaryDirectory()
+        for module_name in ("__main__", "main"):
+            module = sys.modules.get(module_name)
+            if module is not None and hasattr(module, "summarize_site"):
+                original = module.summarize_site
+                self._patches.append((module, "summarize_site", original))
+                module.summarize_site = functools.partial(original, cache_dir=self._brief_cache.name)
+        return self
+
+    def __exit__(self, *exc):
+        for target, attr, value in reversed(self._patches):
+            if isinstance(target, dict):
+                target[attr] = value
+            else:
+                setattr(target, attr, value)
+        self._patches = []
+        if self._brief_cache is not None:
+            self._brief_cache.cleanup()
+            self._brief_cache = None
+
+    def record_run(self, domain: str, options: Dict[str, Any]) -> int:
+        """Store the main.main arguments of a recorded run and return its index."""
+        run = {"kind": "run", "run": len(self.runs), "domain": domain,
+               "options": {key: value for key, value in options.items() if key in RUN_OPTIONS}}
+        self.runs.append(run)
+        self._append(run)
+        return run["run"]
+
+    def record_outcome(self, run: int, rankings: Dict[str, Dict[str, Any]]):
+        """Store the ranks a recorded run produced, for accuracy checks on replay."""
+        outcome = {"kind": "outcome", "run": run, "ranks": rank_table(rankings)}
+        self.outcomes[run] = outcome
+        self._append(outcome)
+
+
+def rank_table(rankings: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Reduce results[llm][prompt] to plain ranks."""
+    return {llm_name: {str(prompt): entry["rank"] for prompt, entry in prompts_data.items()}
+            for llm_name, prompts_data in rankings.items()}
+
+
+def compare_ranks(expected: Dict[str, Dict[str, Any]], actual: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """List every (llm, prompt) whose rank differs, including ones missing on either side."""
+    changes = []
+    for llm_name in sorted(set(expected) | set(actual)):
+        before = expected.get(llm_name, {})
+        after = actual.get(llm_name, {})
+        for prompt in list(before) + [p for p in after if p not in before]:
+            if before.get(prompt) != after.get(prompt):
+                changes.append({"llm": llm_name, "prompt": prompt,
+                                "expected": before.get(prompt), "actual": after.get(prompt)})
+    return changes
+
+
+def benchmark(path: str, latency: str = "zero", repeat: int = 3, verbose: bool = False) -> List[Dict[str, Any]]:
+    """
+    Replay every run in a cassette through the full pipeline.
+
+    Args:
+        path: Cassette file
+        latency: "zero" to time only our own code, "recorded" to replay the
+            providers' recorded latency as well
+        repeat: Replays per run; the median time is reported
+        verbose: Show the pipeline's own output
+
+    Returns:
+        One result per recorded run with timings, rank changes against the
+        recorded outcome and cassette misses, plus an "error" for runs that
+        crashed
+    """
+    import main as pipeline
+
+    results = []
+    for run in Cassette(path, mode="replay").runs:
+        timings = []
+        error = None
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull, \
+                    Cassette(path, mode="replay", latency=latency) as cassette:
+                with contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+                    start = time.perf_counter()
+                    try:
+                        result = asyncio.run(pipeline.main(run["domain"],
+                                                           output_file=os.path.join(tmp, "report.pdf"),
+                                                           archive_file=None, **run["options"]))
+                    except Exception as e:
+                        error = f"{type(e).__name__}: {str(e)}"
+                        break
+                    timings.append(time.perf_counter() - start)
+
+        if error is not None:
+            results.append({"run": run["run"], "domain": run["domain"], "queries": 0, "seconds": None,
+                            "timings": timings, "misses": cassette.misses, "rank_changes": None, "error": error})
+            continue
+
+        outcome = cassette.outcomes.get(run["run"])
+        changes = compare_ranks(outcome["ranks"], rank_table(result["results"])) if outcome else None
+        results.append({
+            "run": run["run"],
+            "domain": run["domain"],
+            "queries": sum(len(prompts_data) for prompts_data in result["results"].values()),
+            "seconds": statistics.median(timings),
+            "timings": timings,
+            "misses": cassette.misses,
+            "rank_changes": changes,
+        })
+    return results
+
+
+def find_regressions(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]] = None,
+                     max_slowdown: float = MAX_SLOWDOWN) -> List[str]:
+    """Describe every accuracy or performance regression in a benchmark."""
+    regressions = []
+    baseline_runs = {entry["run"]: entry for entry in baseline or ()}
+    for entry in results:
+        label = f"run {entry['run']} ({entry['domain']})"
+        if entry.get("error"):
+            regressions.append(f"{label}: failed with {entry['error']}")
+            continue
+        if entry["misses"]:
+            regressions.append(f"{label}: {entry['misses']} calls had no recording")
+        if entry["rank_changes"]:
+            regressions.append(f"{label}: {len(entry['rank_changes'])} ranks differ from the recording")
+        previous = baseline_runs.get(entry["run"])
+        if previous and previous.get("seconds") and entry["seconds"] > previous["seconds"] * (1 + max_slowdown):
+            regressions.append(f"{label}: {entry['seconds']:.2f}s vs {previous['seconds']:.2f}s baseline")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline offline against recorded cassettes.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bench_parser = subparsers.add_parser("bench", help="Replay cassettes through the full pipeline")
+    bench_parser.add_argument("cassettes", nargs="+", help="Cassette files recorded with main.py --record")
+    bench_parser.add_argument("--latency", choices=["zero", "recorded"], default="zero",
+                              help="Replay instantly or at the recorded provider latency")
+    bench_parser.add_argument("--repeat", type=int, default=3, help="Replays per run")
+    bench_parser.add_argument("--baseline", default=None, help="Earlier --output file to compare timings with")
+    bench_parser.add_argument("--max-slowdown", type=float, default=MAX_SLOWDOWN,
+                              help="Allowed slowdown against the baseline, as a fraction")
+    bench_parser.add_argument("--output", default=None, help="Write the results as JSON")
+    bench_parser.add_argument("--verbose", action="store_true", help="Show the pipeline's output")
+
+    show_parser = subparsers.add_parser("show", help="List the runs and calls in a cassette")
+    show_parser.add_argument("cassette", help="Cassette file")
+
+    args = parser.parse_args()
+
+    if args.command == "show":
+        cassette = Cassette(args.cassette)
+        for run in cassette.runs:
+            print(f"run {run['run']}: {run['domain']} {json.dumps(run['options'])}")
+        counts = {}
+        for recordings in cassette.calls.values():
+            for record in recordings:
+                counts[record["name"]] = counts.get(record["name"], 0) + 1
+        for name, count in sorted(counts.items()):
+            print(f"{name}: {count} calls")
+    elif args.command == "bench":
+        results = []
+        for path in args.cassettes:
+            for entry in benchmark(path, args.latency, args.repeat, args.verbose):
+                entry["cassette"] = path
+                results.append(entry)
+                if entry.get("error"):
+                    print(f"{path} run {entry['run']} ({entry['domain']}): failed with {entry['error']}")
+                    continue
+                changes = "n/a" if entry["rank_changes"] is None else len(entry["rank_changes"])
+                print(f"{path} run {entry['run']} ({entry['domain']}): {entry['seconds']:.3f}s median, "
+                      f"{entry['queries']} queries, {changes} rank changes, {entry['misses']} misses")
+
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        regressions = []
+        for path in args.cassettes:
+            regressions += find_regressions([e for e in results if e["cassette"] == path],
+                                            [e for e in baseline or () if e.get("cassette") == path],
+                                            args.max_slowdown)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        sys.exit(1 if regressions else 0)
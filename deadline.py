@@ -0,0 +1,69 @@
+import asyncio
+import time
+from typing import Dict, List
+
+
+# Share of the run's time budget each stage may use, in pipeline order.
+# Budgets are cumulative, so time a stage doesn't use rolls over to the
+# next one. Whatever is left after ranking is kept for the report.
+DEFAULT_STAGE_BUDGETS = {
+    "crawl": 0.10,
+    "summary": 0.10,
+    "keywords": 0.05,
+    "prompts": 0.15,
+    "ranking": 0.55,
+}
+
+
+class RunDeadline:
+    """
+    Run-level deadline with per-stage time budgets.
+
+    Stages ask for their own deadline with stage_deadline() and record any
+    coverage they had to give up with note(), so the report can show it.
+    """
+
+    def __init__(self, seconds: float, stage_budgets: Dict[str, float] = None):
+        self.seconds = seconds
+        self.stage_budgets = stage_budgets or DEFAULT_STAGE_BUDGETS
+        self.start = time.monotonic()
+        self.end = self.start + seconds
+        self.notes: List[str] = []
+
+    def remaining(self) -> float:
+        return max(self.end - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.end
+
+    def stage_deadline(self, stage: str) -> float:
+        """Monotonic time by which a stage should be done."""
+        share = 0.0
+        for name, budget in self.stage_budgets.items():
+            share += budget
+            if name == stage:
+                break
+        return min(self.start + self.seconds * share, self.end)
+
+    def stage_remaining(self, stage: str) -> float:
+        return max(self.stage_deadline(stage) - time.monotonic(), 0.0)
+
+    def note(self, message: str):
+        """Record a coverage gap caused by the deadline."""
+        print(f"Deadline: {message}")
+        self.notes.append(message)
+
+    async def run_stage(self, stage: str, func, *args, fallback=None, **kwargs):
+        """
+        Run a blocking stage function in a thread within its time budget.
+
+        Returns the function's result, or `fallback` if the stage budget
+        runs out first. The thread can't be interrupted, so it is left to
+        finish in the background and its result is dropped.
+        """
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(func, *args, **kwargs),
+                                          timeout=self.stage_remaining(stage))
+        except asyncio.TimeoutError:
+            self.note(f"{stage} stage ran out of time, continuing with a fallback")
+            return fallback
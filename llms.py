@@ -5,8 +5,11 @@ import os
 from typing import List, Dict, Any, Union
 import re
 import json
+import hashlib
 import traceback
 
+from aliases import AliasIndex, get_alias_index
+
 load_dotenv()
 
 
@@ -19,6 +22,36 @@ pplx_client = OpenAI(api_key=pplx_api_key, base_url="https://api.perplexity.ai")
 claude_api_key = os.getenv("ANTHROPIC_API")
 anthropic_client = anthropic.Anthropic(api_key=claude_api_key)
 
+# Name given to the JSON schema / forced tool when asking for structured output
+STRUCTURED_OUTPUT_NAME = "structured_response"
+
+# JSON schema for a single recommended tool
+TOOL_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "url": {"type": "string"},
+        "description": {"type": "string"}
+    },
+    "required": ["name", "url", "description"],
+    "additionalProperties": False
+}
+
+# JSON schema for a structured ranking response: tools in recommendation order
+RANKING_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "tools": {"type": "array", "items": TOOL_SCHEMA}
+    },
+    "required": ["tools"],
+    "additionalProperties": False
+}
+
+
+def prefix_cache_key(system_prompt, cached_prefix):
+    """Stable key for a shared prompt prefix, used to route calls to the same provider cache."""
+    return hashlib.sha256((system_prompt + cached_prefix).encode("utf-8")).hexdigest()[:32]
+
 
 def call_perplexity(system_prompt, prompt, model="sonar-pro"):
         """
@@ -45,7 +78,8 @@ def call_perplexity(system_prompt, prompt, model="sonar-pro"):
         return response
 
 
-def call_perplexity(system_prompt, prompt, model="sonar-medium-online"):
+def call_perplexity(system_prompt, prompt, model="sonar-medium-online", schema=None, max_tokens=None,
+                    cached_prefix=None):
     """Call Perplexity API with system and user prompts."""
     try:
         messages = [
@@ -55,14 +89,20 @@ def call_perplexity(system_prompt, prompt, model="sonar-medium-online"):
             },
             {   
             "role": "user",
-            "content": prompt
+            "content": (cached_prefix or "") + prompt
                 },
             ]
 
+        extra_args = {}
+        if schema is not None:
+            extra_args["response_format"] = {"type": "json_schema", "json_schema": {"schema": schema}}
+        if max_tokens is not None:
+            extra_args["max_tokens"] = max_tokens
         
         response = pplx_client.chat.completions.create(
                 model=model,
                 messages=messages,
+                **extra_args
             )
 
         
@@ -77,13 +117,30 @@ def call_perplexity(system_prompt, prompt, model="sonar-medium-online"):
         return f"Error: {str(e)}"
 
 
-def call_openai(system_prompt, prompt, model="gpt-4o"):
-    """Call OpenAI API with system and user prompts."""
+def call_openai(system_prompt, prompt, model="gpt-4o", schema=None, max_tokens=None, cached_prefix=None):
+    """
+    Call OpenAI API with system and user prompts.
+
+    cached_prefix is put in front of the prompt. OpenAI caches long shared
+    prefixes automatically, and the cache key keeps calls that share the
+    prefix on the same cache.
+    """
     try:
+        extra_args = {}
+        if cached_prefix:
+            prompt = cached_prefix + prompt
+            extra_args["prompt_cache_key"] = prefix_cache_key(system_prompt, cached_prefix)
+        if schema is not None:
+            extra_args["text"] = {"format": {"type": "json_schema", "name": STRUCTURED_OUTPUT_NAME,
+                                             "schema": schema, "strict": True}}
+        if max_tokens is not None:
+            extra_args["max_output_tokens"] = max_tokens
+
         response = oai_client.responses.create(
             model=model,
             instructions=system_prompt,
             input=prompt,
+            **extra_args
             )
         return response.output[0].content[0].text
     except Exception as e:
@@ -91,14 +148,38 @@ def call_openai(system_prompt, prompt, model="gpt-4o"):
         return f"Error: {str(e)}"
 
 
-def call_claude(system_prompt, prompt, model="claude-3-haiku-20240307"):
-    """Call Anthropic Claude API with system and user prompts."""
+def call_claude(system_prompt, prompt, model="claude-3-haiku-20240307", schema=None, max_tokens=None,
+                cached_prefix=None):
+    """
+    Call Anthropic Claude API with system and user prompts.
+
+    cached_prefix is sent as its own content block marked with
+    cache_control, so the system prompt and prefix are cached across calls.
+    """
     try:
+        extra_args = {}
+        content = prompt
+        if cached_prefix:
+            content = [
+                {"type": "text", "text": cached_prefix, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": prompt}
+            ]
+        if schema is not None:
+            # Claude has no response_format, so force a single tool call whose
+            # input schema is the structure we want back
+            extra_args["tools"] = [{
+                "name": STRUCTURED_OUTPUT_NAME,
+                "description": "Return the answer in this structure.",
+                "input_schema": schema
+            }]
+            extra_args["tool_choice"] = {"type": "tool", "name": STRUCTURED_OUTPUT_NAME}
+
         message = anthropic_client.messages.create(
             model=model,
-            max_tokens=1024,
+            max_tokens=max_tokens or 1024,
             system=system_prompt,
-            messages=[{"role": "user", "content": prompt}]
+            messages=[{"role": "user", "content": content}],
+            **extra_args
         )
         
         # Handle Claude's response format
@@ -106,7 +187,9 @@ def call_claude(system_prompt, prompt, model="claude-3-haiku-20240307"):
             # Extract text from all content blocks
             full_text = ""
             for content_block in message.content:
-                if hasattr(content_block, 'text'):
+                if getattr(content_block, 'type', None) == 'tool_use':
+                    full_text += json.dumps(content_block.input)
+                elif hasattr(content_block, 'text'):
                     full_text += content_block.text
                 elif isinstance(content_block, dict) and 'text' in content_block:
                     full_text += content_block['text']
@@ -335,7 +418,64 @@ def parse_perplexity_response(response_text: str) -> List[Dict[str, str]]:
 
 
 
-def find_rank_in_tools(domain: str, brand: str, tools: List[Dict[str, str]]) -> Union[int, str]:
+def normalize_tool_records(items: Any) -> Union[List[Dict[str, str]], None]:
+    """
+    Validate a decoded JSON list of tools and coerce it to the parser output shape.
+    
+    Args:
+        items: Decoded JSON value that should be a list of tool objects
+        
+    Returns:
+        List of dictionaries with 'name', 'description' and 'url' keys, or
+        None if the value doesn't look like a list of tools
+    """
+    if not isinstance(items, list):
+        return None
+    
+    tools = []
+    for item in items:
+        if not isinstance(item, dict):
+            return None
+        name = item.get('name')
+        if not isinstance(name, str) or not name.strip():
+            return None
+        url = item.get('url') or ''
+        description = item.get('description') or ''
+        if not isinstance(url, str) or not isinstance(description, str):
+            return None
+        tools.append({'name': name.strip(), 'url': url.strip(), 'description': description.strip()})
+    
+    return tools
+
+
+def parse_structured_response(response_text: str, fallback_parser=None) -> List[Dict[str, str]]:
+    """
+    Decode a JSON-schema-constrained ranking response into a list of tools.
+    
+    Args:
+        response_text: Raw JSON text matching RANKING_SCHEMA
+        fallback_parser: Optional regex parser to use if the text isn't
+            valid structured output (e.g. the provider ignored the schema)
+        
+    Returns:
+        List of dictionaries, each with 'name', 'description', and 'url' keys
+    """
+    try:
+        data = json.loads(response_text)
+    except (TypeError, ValueError):
+        data = None
+    
+    tools = normalize_tool_records(data.get('tools')) if isinstance(data, dict) else None
+    if tools is not None:
+        return tools
+    
+    if fallback_parser is not None:
+        return fallback_parser(response_text)
+    return []
+
+
+def find_rank_in_tools(domain: str, brand: str, tools: List[Dict[str, str]],
+                       alias_index: AliasIndex = None) -> Union[int, str]:
     """
     Find the ranking of a domain/brand in a list of parsed tools.
     
@@ -343,33 +483,28 @@ def find_rank_in_tools(domain: str, brand: str, tools: List[Dict[str, str]]) ->
         domain: Domain to search for (e.g., "neosync.dev")
         brand: Brand name to search for (e.g., "Neosync")
         tools: List of tool dictionaries with 'name', 'description', and 'url' keys
+        alias_index: Prebuilt AliasIndex for the domain/brand, looked up from
+            a shared cache if not given
         
     Returns:
         int: Position in the list (1-based) if found
         str: "Mentioned (unranked)" if mentioned but not as a primary tool
         str: "Not mentioned" if not found at all
     """
-    # Clean domain and brand for comparison
-    domain_clean = domain.lower().replace("https://", "").replace("http://", "").replace("www.", "")
-    brand_clean = brand.lower()
+    if alias_index is None:
+        alias_index = get_alias_index(domain, brand)
     
     # First check if any tools directly mention our domain/brand
     for i, tool in enumerate(tools):
-        tool_name = tool.get('name', '').lower()
-        tool_url = tool.get('url', '').lower()
-        tool_desc = tool.get('description', '').lower()
-        
         # Check name and URL first (these are more important matches)
-        if (domain_clean in tool_url or 
-            brand_clean in tool_name or 
-            domain_clean in tool_name):
+        if (alias_index.matches_domain(tool.get('url', '')) or
+            alias_index.matches(tool.get('name', ''), fuzzy=True)):
             return i + 1  # Return 1-based position
             
     # If not found as a primary mention, check for secondary mentions in descriptions
     for tool in tools:
-        tool_desc = tool.get('description', '').lower()
-        if domain_clean in tool_desc or brand_clean in tool_desc:
+        if alias_index.matches(tool.get('description', '')):
             return "Mentioned (unranked)"
     
     # If we get here, the domain/brand was not mentioned
-    return "Not mentioned"
\ No newline at end of file
+    return "Not mentioned"
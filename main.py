@@ -1,13 +1,27 @@
-from llms import call_openai, call_perplexity, call_claude,parse_openai_response,find_rank_in_tools
+from llms import call_openai, call_perplexity, call_claude
+from ranking import LLMS, build_request, build_result_entry, get_parser, score_response, timed_call
+from aliases import get_alias_index, registrable_domain
+from records import MentionStatus, Prompt, QueryResult, RankingTally, prompt_keyword
+from archive import DEFAULT_ARCHIVE, ResponseArchive, make_record
+from workqueue import WorkQueue, start_workers
+from summary import summarize_site
+from planner import format_plan, plan_run
+from deadline import RunDeadline
+from profiling import StageProfiler
 from dotenv import load_dotenv
 from fpdf import FPDF
 import re
 import asyncio
+import time
 from tqdm import tqdm
 from crawl import scrape_website
 import json
 import traceback
 from pdf import generate_pdf_report
+from tokens import (DEFAULT_MAX_OUTPUT_TOKENS, KEYWORD_INPUT_TOKENS, MAX_CONCURRENT_QUERIES,
+                    PROMPT_CONTEXT_TOKENS, count_tokens, estimate_request_tokens, get_scheduler,
+                    truncate_to_tokens)
+from packed import unpack_packed_response
 
 load_dotenv()
 
@@ -35,7 +49,7 @@ def extract_keywords(text, top_k=10):
     Return them as a comma-separated list with no extra commentary.
 
     Text:
-    {text[:5000]}  # Limit text length to avoid token limits
+    {truncate_to_tokens(text, KEYWORD_INPUT_TOKENS, "openai")}
     """
 
     content = call_openai(system_prompt, prompt)
@@ -48,160 +62,381 @@ def extract_keywords(text, top_k=10):
     # Return top_k keywords
     return keywords[:top_k]
 
-def generate_prompts_llm(keywords, domain_description, prompts_per_keyword=5):
+PROMPT_SYSTEM_PROMPT = "You are an LLM search  export who is a master at coming up with the exact phrases that a real user would use to search for different software tools in ChatGPT, Perplexity and Claude."
+
+# How many prompts may wait between prompt generation and each provider's
+# ranking stage before generation pauses
+PIPELINE_QUEUE_SIZE = MAX_CONCURRENT_QUERIES * 4
+
+
+def build_prompt_prefix(domain_description, prompts_per_keyword):
     """
-    - keywords: list of strings
-    - domain_description: short text describing the product or service
-    - prompts_per_keyword: how many distinct queries to generate per keyword
+    Build the shared prompt-generation prefix: identical for every keyword,
+    so provider prompt caching applies. Keep anything that varies out of it.
     """
+    # Only send the site markdown, cut down to a token budget
+    if isinstance(domain_description, dict) and 'markdown' in domain_description:
+        domain_description = domain_description['markdown']
+    domain_description = truncate_to_tokens(str(domain_description), PROMPT_CONTEXT_TOKENS, "openai")
 
-    system_prompt = "You are an LLM search  export who is a master at coming up with the exact phrases that a real user would use to search for different software tools in ChatGPT, Perplexity and Claude."
-
-    all_prompts = []
-    for kw in keywords:
-        prompt = f"""
-        This is the markdown text from the website: {domain_description}. 
-        The keyword is: {kw}.
+    return f"""
+        This is a description of the website:
+        {domain_description}
 
-        Please generate {prompts_per_keyword} distinct user-like queries 
+        I will give you a keyword. Please generate {prompts_per_keyword} distinct user-like queries 
         that someone might type into an LLM-based search tool (like ChatGPT) 
-        if they want to find a product or solution related to '{kw}'. 
+        if they want to find a product or solution related to that keyword. 
         Make them natural-sounding and relevant to discovering new tools or advice.
 
         Return them as a numbered list only, with no extra commentary.
         """
 
 
-        content = call_openai(system_prompt, prompt)
+def generate_keyword_prompts(keyword, prefix):
+    """Generate and parse the search prompts for one keyword, tagged with that keyword."""
+    prompt = f"""
+        The keyword is: {keyword}
+        """
+
+    content = call_openai(PROMPT_SYSTEM_PROMPT, prompt, cached_prefix=prefix)
+
+    print("the content", content)
+
+    prompts = []
+    # Parse line by line
+    lines = content.strip().split('\n')
+    # Filter out lines that contain the queries
+    for line in lines:
+        line = line.strip()
+        # Very rough parse: if it starts with a digit and a period
+        if line and (line[0].isdigit() or line.startswith('-')):
+            # Strip leading numbers / punctuation
+            prompt_text = line.lstrip('0123456789.-) ').strip()
+            prompts.append(Prompt(prompt_text, keyword))
+    return prompts
+
+
+def generate_prompts_llm(keywords, domain_description, prompts_per_keyword=5, deadline=None):
+    """
+    - keywords: list of strings
+    - domain_description: short text describing the product or service,
+      ideally the brief from summary.summarize_site
+    - prompts_per_keyword: how many distinct queries to generate per keyword
+    - deadline: optional time.monotonic() value; keywords are handled in
+      order and the rest are dropped once it passes
 
-        print("the content", content)
+    Every call shares the same system prompt and domain prefix and only the
+    short keyword suffix changes, so provider prompt caching applies.
+    """
+    prefix = build_prompt_prefix(domain_description, prompts_per_keyword)
 
-        # Parse line by line
-        lines = content.strip().split('\n')
-        # Filter out lines that contain the queries
-        for line in lines:
-            line = line.strip()
-            # Very rough parse: if it starts with a digit and a period
-            if line and (line[0].isdigit() or line.startswith('-')):
-                # Strip leading numbers / punctuation
-                prompt_text = line.lstrip('0123456789.-) ').strip()
-                all_prompts.append(prompt_text)
+    all_prompts = []
+    seen = set()
+    for i, kw in enumerate(keywords):
+        if deadline is not None and time.monotonic() >= deadline:
+            print(f"Deadline reached, skipping prompt generation for {len(keywords) - i} keywords")
+            break
+        for prompt in generate_keyword_prompts(kw, prefix):
+            # Results are keyed by prompt text, so a prompt generated for two
+            # keywords is asked once, under the first
+            if prompt not in seen:
+                seen.add(prompt)
+                all_prompts.append(prompt)
 
     return all_prompts
 
-async def run_llm_queries(prompts, domain, brand_name="Neosync"):
+
+async def stream_prompts(keywords, domain_description, prompt_queue, prompts_per_keyword=5, deadline=None):
+    """
+    Generate prompts keyword by keyword and put each one on prompt_queue as
+    soon as it is parsed, followed by None once done.
+
+    Same arguments as generate_prompts_llm. prompt_queue should be bounded,
+    so generation waits whenever ranking falls behind.
+
+    Returns:
+        The keywords that were skipped because the deadline passed
+    """
+    prefix = build_prompt_prefix(domain_description, prompts_per_keyword)
+    skipped = []
+    seen = set()  # duplicate prompts are asked once, see generate_prompts_llm
+    try:
+        for i, kw in enumerate(keywords):
+            if deadline is not None and time.monotonic() >= deadline:
+                skipped = list(keywords[i:])
+                print(f"Deadline reached, skipping prompt generation for {len(skipped)} keywords")
+                break
+            try:
+                prompts = await asyncio.to_thread(generate_keyword_prompts, kw, prefix)
+            except Exception as e:
+                print(f"Error generating prompts for {kw}: {str(e)}")
+                continue
+            for prompt in prompts:
+                if prompt not in seen:
+                    seen.add(prompt)
+                    await prompt_queue.put(prompt)
+    finally:
+        await prompt_queue.put(None)
+    return skipped
+
+
+async def _fan_out(source, targets, order):
+    """Copy every prompt from source to each target queue, recording arrival order."""
+    while True:
+        prompt = await source.get()
+        if prompt is not None:
+            order.append(prompt)
+        for target in targets:
+            await target.put(prompt)
+        if prompt is None:
+            return
+
+
+async def _rank_provider(llm_name, llm_config, source, results, domain, brand_name, alias_index,
+                         pack_size=None, structured=False, archive=None, deadline=None, on_result=None):
+    """
+    Ranking stage for one provider: take prompts from source as they arrive
+    and keep up to MAX_CONCURRENT_QUERIES calls in flight within the
+    provider's TPM budget. See run_llm_queries for the arguments.
+    """
+    caller_func = llm_config["caller"]
+    parser_func = get_parser(llm_name, structured)
+    job_size = pack_size if pack_size and pack_size > 1 else 1
+
+    def estimate(job):
+        job_system, job_prompt, _ = build_request(job, structured)
+        return estimate_request_tokens(job_system, job_prompt, llm_name,
+                                       max_output_tokens=DEFAULT_MAX_OUTPUT_TOKENS * len(job))
+
+    mentioned = 0
+
+    def record(prompt, entry, progress):
+        nonlocal mentioned
+        entry.keyword = prompt_keyword(prompt)
+        results[prompt] = entry
+        progress.update(1)
+        if entry.is_mentioned:
+            mentioned += 1
+            progress.set_postfix(mentioned=mentioned)
+        if on_result is not None:
+            on_result(llm_name, prompt, entry)
+
+    # Schedule calls against the provider's tokens-per-minute budget, shared
+    # with any other run in this process
+    scheduler = get_scheduler(llm_name)
+    buffer = []  # prompts waiting to fill a packed job
+    pending = []  # (job, estimated_tokens) ready to send
+    in_flight = {}  # task -> (job, system, prompt, reservation)
+    source_done = False
+
+    def wants_prompt():
+        # Only take prompts there is room to work on, so a slow provider
+        # leaves them on the bounded source queue and generation blocks
+        return (not source_done and len(buffer) < job_size
+                and len(in_flight) + len(pending) < MAX_CONCURRENT_QUERIES)
+
+    def take(prompt, progress):
+        nonlocal source_done, buffer
+        if prompt is None:
+            source_done = True
+        else:
+            buffer.append(prompt)
+            progress.total += 1
+            progress.refresh()
+        if len(buffer) >= job_size or (source_done and buffer):
+            job, buffer = tuple(buffer), []
+            pending.append((job, estimate(job)))
+
+    with tqdm(total=0, desc=f"{llm_name} queries") as progress:
+        while True:
+            # Take whatever prompts have arrived without waiting
+            while wants_prompt() and not source.empty():
+                take(source.get_nowait(), progress)
+
+            if source_done and not pending and not in_flight:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+
+            # Top up the calls in flight. Under a deadline, send prompts in
+            # priority order rather than cheapest first
+            if pending and len(in_flight) < MAX_CONCURRENT_QUERIES:
+                batch, pending = scheduler.pack(pending, max_batch=MAX_CONCURRENT_QUERIES - len(in_flight),
+                                                in_order=deadline is not None)
+                for job, tokens in batch:
+                    job_system, job_prompt, kwargs = build_request(job, structured)
+                    reservation = scheduler.reserve(tokens)
+                    task = asyncio.ensure_future(
+                        asyncio.to_thread(timed_call, caller_func, job_system, job_prompt, **kwargs))
+                    in_flight[task] = (job, job_system, job_prompt, reservation)
+
+            # Wait for a call to finish, a new prompt, or TPM capacity
+            waiters = set(in_flight)
+            getter = None
+            if wants_prompt():
+                getter = asyncio.ensure_future(source.get())
+                waiters.add(getter)
+            capacity = None
+            if pending and len(in_flight) < MAX_CONCURRENT_QUERIES:
+                capacity = asyncio.ensure_future(scheduler.wait_for_capacity())
+                waiters.add(capacity)
+            timeout = max(deadline - time.monotonic(), 0) if deadline is not None else None
+            done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if capacity is not None and not capacity.done():
+                capacity.cancel()
+            if getter is not None:
+                if getter.done():
+                    take(getter.result(), progress)
+                else:
+                    getter.cancel()
+
+            for task in done:
+                if task not in in_flight:
+                    continue
+                job, job_system, job_prompt, reservation = in_flight.pop(task)
+                response = task.exception() or task.result()
+                if isinstance(response, Exception):
+                    print(f"Unexpected error processing {job_prompt} with {llm_name}: {str(response)}")
+                    raw_response = f"Error: {str(response)}"
+                else:
+                    raw_response, latency = response
+                    input_tokens = count_tokens(job_system, llm_name) + count_tokens(job_prompt, llm_name)
+                    output_tokens = count_tokens(raw_response, llm_name)
+                    scheduler.settle(reservation, input_tokens + output_tokens)
+                    if archive is not None:
+                        archive.append(make_record(llm_name, job, raw_response, packed=len(job) > 1,
+                                                   structured=structured, domain=domain, latency=latency,
+                                                   input_tokens=input_tokens, output_tokens=output_tokens))
+
+                if len(job) == 1:
+                    record(job[0], score_response(llm_name, job[0], raw_response, parser_func, domain,
+                                                  brand_name, alias_index), progress)
+                    continue
+
+                # Unpack the packed answers, anything invalid goes back as a single call
+                for prompt, tools in unpack_packed_response(raw_response, list(job)).items():
+                    if tools is None:
+                        pending.append(((prompt,), estimate((prompt,))))
+                        continue
+                    entry = build_result_entry(json.dumps(tools), tools, domain, brand_name, alias_index)
+                    entry.packed = True
+                    record(prompt, entry, progress)
+
+    # Cancelled at the deadline, these prompts get marked as skipped
+    for task in in_flight:
+        task.cancel()
+
+
+async def run_llm_queries(prompts, domain, brand_name="Neosync", pack_size=None, structured=False, archive=None,
+                          aliases=None, deadline=None, on_result=None):
     """
     Run search queries across multiple LLMs and track domain rankings.
     
     Args:
-        prompts: List of search prompts to test
+        prompts: List of search prompts to test, or an asyncio.Queue that
+            prompts are put on as they are generated, ended by None (see
+            stream_prompts). Each provider starts on a prompt as soon as it
+            arrives.
         domain: Domain to track rankings for (e.g., "neosync.dev")
         brand_name: Brand name to also look for in responses
+        pack_size: If set above 1, answer this many prompts per call using a
+            JSON-schema response. Prompts whose packed answer fails
+            validation are retried as single calls. Packed entries are
+            tagged with "packed": True.
+        structured: If True, ask each provider for a JSON-schema list of
+            {name, url, description} objects and decode it directly, keeping
+            the regex parsers only as a fallback.
+        archive: Optional ResponseArchive that every full raw response is
+            appended to, for offline re-ranking with archive.py
+        aliases: Extra names or domains the brand goes by (e.g. "Neon
+            Postgres", "neon.com")
+        deadline: Optional time.monotonic() value to finish by. Prompts are
+            sent in priority (arrival) order, and whatever hasn't been
+            answered when time is up is cancelled and marked as skipped.
+        on_result: Optional callback(llm_name, prompt, entry) called as each
+            result comes in, for incremental aggregation
         
     Returns:
         Dictionary with rankings by LLM and prompt
     """
-    # Clean domain for comparison
-    clean_domain = domain.replace("https://", "").replace("http://", "").replace("www.", "")
-    
-    # Define system prompt for all LLMs
-    system_prompt = """
-    You are a helpful assistant that recommends software tools and solutions.
-    When asked about tools in a certain category, provide a clear numbered list of the top options.
-    For each tool, include:
-    1. The name of the tool
-    2. A brief description (1-2 sentences)
-    3. The website URL if you know it
-    
-    Format your response as a numbered list with 5-10 items. Do not include any disclaimers or additional commentary.
-    """
-    
-    # Dictionary to store results
-    results = {}
-    
-    # Define which LLMs to use with their respective calling functions and parsers
-    llms = {
-        "openai": {
-            "caller": call_openai,
-            "parser": parse_openai_response
-        },
-        # "claude": {
-        #     "caller": call_claude,
-        #     "parser": parse_claude_response
-        # },
-        # "perplexity": {
-        #     "caller": call_perplexity,
-        #     "parser": parse_perplexity_response
-        # }
-    }
-    
-    # Process each LLM
-    for llm_name, llm_config in llms.items():
-        print(f"\nProcessing {llm_name} queries...")
-        results[llm_name] = {}
-        
-        caller_func = llm_config["caller"]
-        parser_func = llm_config["parser"]
-        
-        for prompt in tqdm(prompts, desc=f"{llm_name} queries"):
-            try:
-                # 1. Call the LLM
-                raw_response = caller_func(system_prompt, prompt)
-                
-                # Save the raw response for reference
-                raw_response_preview = (raw_response[:500] + "..." 
-                                      if len(raw_response) > 500 else raw_response)
-                
-                # 2. Parse the response to get structured tool data
-                try:
-                    parsed_tools = parser_func(raw_response)
-                except Exception as e:
-                    print(f"Error parsing {llm_name} response for prompt '{prompt[:30]}...': {str(e)}")
-                    traceback.print_exc()
-                    parsed_tools = []
-                
-                # 3. Find where our domain/brand ranks in the parsed tools
-                if parsed_tools:
-                    rank = find_rank_in_tools(clean_domain, brand_name, parsed_tools)
-                else:
-                    # If parsing failed but we have a response, fall back to text search
-                    if "Error:" not in raw_response:
-                        # Simple text-based mention check
-                        if clean_domain in raw_response.lower() or brand_name.lower() in raw_response.lower():
-                            rank = "Mentioned (parsing failed)"
-                        else:
-                            rank = "Not mentioned (parsing failed)"
-                    else:
-                        rank = "Error"
-                
-                # Store results
-                results[llm_name][prompt] = {
-                    "rank": rank,
-                    "response": raw_response_preview,
-                    "parsed_tools_count": len(parsed_tools)
-                }
-                
-                # Add parsed tools for reference (limit to 3 for brevity)
-                if parsed_tools:
-                    results[llm_name][prompt]["sample_tools"] = parsed_tools[:3]
-                
-            except Exception as e:
-                print(f"Unexpected error processing {prompt} with {llm_name}: {str(e)}")
-                traceback.print_exc()
-                results[llm_name][prompt] = {
-                    "rank": "Error",
-                    "response": f"Error: {str(e)}",
-                    "parsed_tools_count": 0
-                }
-            
-            # Add a small delay to avoid rate limits
-            await asyncio.sleep(0.5)
+    # Brand/domain matching index, shared with other runs for the same brand
+    alias_index = get_alias_index(domain, brand_name, aliases or ())
+
+    if isinstance(prompts, asyncio.Queue):
+        source = prompts
+    else:
+        source = asyncio.Queue()
+        for prompt in prompts:
+            source.put_nowait(prompt)
+        source.put_nowait(None)
+
+    # Each provider gets its own bounded queue and runs alongside the others
+    provider_queues = {llm_name: asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE) for llm_name in LLMS}
+    results = {llm_name: {} for llm_name in LLMS}
+    order = []
+    fan_out = asyncio.create_task(_fan_out(source, list(provider_queues.values()), order))
+    try:
+        await asyncio.gather(*(
+            _rank_provider(llm_name, llm_config, provider_queues[llm_name], results[llm_name], domain, brand_name,
+                           alias_index, pack_size=pack_size, structured=structured, archive=archive,
+                           deadline=deadline, on_result=on_result)
+            for llm_name, llm_config in LLMS.items()
+        ))
+    finally:
+        fan_out.cancel()
+
+    for llm_name in LLMS:
+        # Anything not answered was dropped at the deadline
+        skipped = [prompt for prompt in order if prompt not in results[llm_name]]
+        if skipped:
+            print(f"Deadline reached for {llm_name}, skipped {len(skipped)} of {len(order)} queries")
+
+        # Keep entries in prompt order regardless of completion order
+        results[llm_name] = {prompt: results[llm_name].get(prompt)
+                             or QueryResult(MentionStatus.SKIPPED, keyword=prompt_keyword(prompt))
+                             for prompt in order}
     
     return results
 
 
-async def main(domain, max_pages=10, output_file="llm_ranking_report.pdf"):
-    """Main function to run the entire workflow."""
+async def main(domain, max_pages=10, output_file="llm_ranking_report.pdf", pack_size=None, structured=False,
+               archive_file=DEFAULT_ARCHIVE, aliases=None, queue_file=None, workers=4,
+               top_k=10, prompts_per_keyword=3, deadline_seconds=None, profile_dir=None,
+               profile_memory=False):
+    """
+    Main function to run the entire workflow.
+
+    pack_size turns on packed multi-query mode and structured turns on
+    JSON-schema ranking output for the ranking step, see run_llm_queries.
+    Full raw responses are appended to archive_file (None to disable).
+    aliases are extra brand names or domains to match.
+
+    With queue_file set, the ranking step enqueues its jobs into that
+    SQLite work queue instead, starts `workers` local worker processes
+    (more can join with `python workqueue.py worker <queue_file>`) and
+    reduces the results once every job has finished. Queue workers send
+    one prompt per call, so queue_file can't be combined with pack_size.
+
+    With deadline_seconds set, each stage gets a share of that time budget
+    (see deadline.DEFAULT_STAGE_BUDGETS). A stage that runs out of time
+    falls back to what it has, and the report lists the coverage gaps.
+
+    With profile_dir set, each stage is CPU-sampled and the collapsed
+    stacks are written there; profile_memory adds tracemalloc allocation
+    tables, at a much higher cost. See profiling.StageProfiler.
+    """
+    if queue_file and pack_size and pack_size > 1:
+        raise ValueError("Queue workers don't pack prompts, pack_size can't be used with queue_file")
+
+    deadline = RunDeadline(deadline_seconds) if deadline_seconds else None
+    profiler = StageProfiler(profile_dir, trace_allocations=profile_memory) if profile_dir else None
+
+    async def run_stage(stage, func, *args, fallback=None, **kwargs):
+        if deadline is None:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        return await deadline.run_stage(stage, func, *args, fallback=fallback, **kwargs)
+
     # Extract domain name for brand searching
     brand_name = domain.replace("https://", "").replace("http://", "").replace("www.", "").split('.')[0]
     brand_name = brand_name.capitalize()
@@ -209,62 +444,144 @@ async def main(domain, max_pages=10, output_file="llm_ranking_report.pdf"):
 
     print("brand", brand_name)
 
-    # 1. Scrape website content or use provided content
-    print("\n--- Step 1: Getting Website Content ---")
+    if profiler:
+        profiler.start("crawl")
     try:
-        # Use md_text if it's already imported and available
-        # if 'md_text' in globals() and isinstance(md_text, dict) and 'markdown' in md_text:
-        #     website_content = md_text
-        #     print("Using pre-loaded website content")
-        # else:
-        website_content = scrape_website(domain, max_pages)
-
-        print("websitecontn", website_content)
+        # 1. Scrape website content or use provided content
+        print("\n--- Step 1: Getting Website Content ---")
+        try:
+            # Use md_text if it's already imported and available
+            # if 'md_text' in globals() and isinstance(md_text, dict) and 'markdown' in md_text:
+            #     website_content = md_text
+            #     print("Using pre-loaded website content")
+            # else:
+            website_content = await run_stage("crawl", scrape_website, domain, max_pages)
+
+            print("websitecontn", website_content)
         
-        # Check if website_content is already a string or a dict with 'markdown' key
-        if isinstance(website_content, dict) and 'markdown' in website_content:
-            markdown_content = website_content['markdown']
-        elif isinstance(website_content, str):
-            markdown_content = website_content
-        else:
-            print("Failed to get website content. Using example data.")
-            markdown_content = 'Example website content'
-            website_content = {'markdown': markdown_content}
-    except Exception as e:
-            markdown_content = 'Example website content'
-            website_content = {'markdown': markdown_content}
-    
-    # 2. Extract keywords from content
-    print("\n--- Step 2: Extracting Keywords ---")
-    keywords = extract_keywords(markdown_content, top_k=10)
-    
-    # 3. Generate search prompts from keywords
-    print("\n--- Step 3: Generating Search Prompts ---")
-    prompts = generate_prompts_llm(keywords, website_content, prompts_per_keyword=3)
+            # Check if website_content is already a string or a dict with 'markdown' key
+            if isinstance(website_content, dict) and 'markdown' in website_content:
+                markdown_content = website_content['markdown']
+            elif isinstance(website_content, str):
+                markdown_content = website_content
+            else:
+                print("Failed to get website content. Using example data.")
+                markdown_content = 'Example website content'
+                website_content = {'markdown': markdown_content}
+        except Exception as e:
+                markdown_content = 'Example website content'
+                website_content = {'markdown': markdown_content}
     
-    # 4. Run search queries across multiple LLMs
-    print("\n--- Step 4: Running LLM Queries ---")
-    llm_results = await run_llm_queries(prompts, domain, brand_name)
+        # 2. Summarize the site and extract keywords. Both only need the crawl,
+        # so they run side by side
+        print("\n--- Step 2: Summarizing Site and Extracting Keywords ---")
+        if profiler:
+            profiler.switch("analysis")
+        domain_brief, keywords = await asyncio.gather(
+            # Without time for a summary, the truncated crawl stands in for the brief
+            run_stage("summary", summarize_site, markdown_content,
+                      fallback=truncate_to_tokens(markdown_content, PROMPT_CONTEXT_TOKENS)),
+            run_stage("keywords", extract_keywords, markdown_content, top_k=top_k, fallback=[]),
+        )
+
+        # Prompt generation and ranking overlap, so they are profiled as one stage
+        if profiler:
+            profiler.switch("ranking")
+        prompts_deadline = deadline.stage_deadline("prompts") if deadline else None
+        ranking_deadline = deadline.stage_deadline("ranking") if deadline else None
+        if queue_file:
+            # Workers exit once the queue is drained, so queue the whole run at once
+            print("\n--- Step 3: Generating Search Prompts ---")
+            prompts = await asyncio.to_thread(generate_prompts_llm, keywords, domain_brief,
+                                              prompts_per_keyword=prompts_per_keyword, deadline=prompts_deadline)
+            if deadline and time.monotonic() >= prompts_deadline:
+                deadline.note(f"prompt generation ran out of time, {len(prompts)} prompts from {len(keywords)} keywords")
+
+            print("\n--- Step 4: Running LLM Queries ---")
+            queue = WorkQueue(queue_file)
+            run_id = queue.create_run(domain, brand_name, keywords, aliases or (), structured)
+            queue.enqueue(run_id, list(LLMS), prompts)
+            print(f"Queued run {run_id} in {queue_file}")
+            processes = start_workers(queue_file, workers, archive_file)
+            # Unfinished jobs stay queued for any remote workers, but this report won't wait for them
+            unfinished = dict(status=MentionStatus.SKIPPED)
+            try:
+                timeout = max(ranking_deadline - time.monotonic(), 0) if ranking_deadline else None
+                if not await asyncio.wait_for(queue.wait_for_run(run_id, workers=processes), timeout=timeout):
+                    exit_codes = [process.exitcode for process in processes]
+                    print(f"All queue workers exited (exit codes {exit_codes}) with jobs left: {queue.counts(run_id)}")
+                    unfinished = dict(status=MentionStatus.ERROR, response="Error: no queue workers left to run the job")
+            except asyncio.TimeoutError:
+                for process in processes:
+                    process.terminate()
+            for process in processes:
+                process.join()
+            llm_results = queue.results(run_id)
+            queue.close()
+            for llm_name in LLMS:
+                provider_results = llm_results.get(llm_name, {})
+                llm_results[llm_name] = {
+                    prompt: provider_results.get(prompt) or QueryResult(**unfinished, keyword=prompt_keyword(prompt))
+                    for prompt in prompts
+                }
+        else:
+            # 3 and 4. Generate prompts and rank them as a pipeline: each
+            # keyword's prompts go to the providers as soon as they are parsed
+            print("\n--- Steps 3-4: Generating Search Prompts and Running LLM Queries ---")
+            archive = ResponseArchive(archive_file) if archive_file else None
+            prompt_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+            tally = RankingTally()
+            producer = asyncio.create_task(stream_prompts(keywords, domain_brief, prompt_queue,
+                                                          prompts_per_keyword=prompts_per_keyword,
+                                                          deadline=prompts_deadline))
+            llm_results = await run_llm_queries(prompt_queue, domain, brand_name, pack_size=pack_size,
+                                                structured=structured, archive=archive, aliases=aliases,
+                                                deadline=ranking_deadline, on_result=tally.add)
+            if deadline is None or producer.done():
+                skipped_keywords = await producer
+                if skipped_keywords:
+                    deadline.note(f"prompt generation ran out of time, skipped {len(skipped_keywords)} of "
+                                  f"{len(keywords)} keywords")
+            else:
+                # Ranking stopped at the deadline before generation finished
+                producer.cancel()
+                deadline.note("prompt generation was still running when ranking stopped")
+            prompts = list(next(iter(llm_results.values()), {}))
+            print(tally.format())
+
+        if deadline:
+            for llm_name, provider_results in llm_results.items():
+                n_skipped = sum(1 for entry in provider_results.values() if entry.status is MentionStatus.SKIPPED)
+                if n_skipped:
+                    deadline.note(f"{llm_name}: {n_skipped} of {len(provider_results)} queries skipped at the deadline")
     
-    # 5. Generate PDF report
-    print("\n--- Step 5: Generating PDF Report ---")
+        # 5. Generate PDF report
+        print("\n--- Step 5: Generating PDF Report ---")
+        if profiler:
+            profiler.switch("report")
 
-    print("llm_results", llm_results)
-    print("domain", domain)
-    print("keywords", keywords)
+        print("llm_results", llm_results)
+        print("domain", domain)
+        print("keywords", keywords)
 
 
 
 
 
-    try:
-        report_file = generate_pdf_report(llm_results, domain, keywords, output_file)
-        print(f"\nAnalysis complete! Report saved to: {report_file}")
-    except Exception as e:
-        print(f"Error generating PDF report: {str(e)}")
-        traceback.print_exc()
-        print("\nAnalysis completed, but PDF generation failed.")
-    
+        try:
+            # Rendering is CPU-bound, keep it off the event loop other runs may share
+            report_file = await asyncio.to_thread(generate_pdf_report, llm_results, domain, keywords, output_file,
+                                                  coverage_notes=deadline.notes if deadline else None)
+            print(f"\nAnalysis complete! Report saved to: {report_file}")
+        except Exception as e:
+            print(f"Error generating PDF report: {str(e)}")
+            traceback.print_exc()
+            print("\nAnalysis completed, but PDF generation failed.")
+    finally:
+        # Write the profile even when a stage fails, so the failing run can be looked at
+        if profiler:
+            print(f"Profile written to: {profiler.stop()}")
+
     return {
         "domain": domain,
         "keywords": keywords,
@@ -275,12 +592,86 @@ async def main(domain, max_pages=10, output_file="llm_ranking_report.pdf"):
 
 
 if __name__ == "__main__":
-    import sys
-    
-    # Get domain from command line argument or use default
+    import argparse
+    import os
+    import random
     
-    print(f"Starting LLM ranking analysis for: {domain}")
-    print("=" * 50)
+    parser = argparse.ArgumentParser(description="Analyze how a domain ranks in LLM search results.")
+    parser.add_argument("domains", nargs="*", default=[domain], help="Domains to analyze")
+    parser.add_argument("--plan", action="store_true",
+                        help="Estimate calls, tokens, cost and wall time without making any paid calls")
+    parser.add_argument("--top-k", type=int, default=10, help="Keywords to extract per domain")
+    parser.add_argument("--prompts-per-keyword", type=int, default=3, help="Search prompts per keyword")
+    parser.add_argument("--pack-size", type=int, default=None, help="Answer this many prompts per ranking call")
+    parser.add_argument("--structured", action="store_true", help="Ask for JSON-schema ranking output")
+    parser.add_argument("--alias", action="append", default=[], help="Extra brand name or domain to match")
+    parser.add_argument("--archive", default=DEFAULT_ARCHIVE, help="Raw response archive")
+    parser.add_argument("--queue", default=None, help="Run the ranking step through this SQLite work queue")
+    parser.add_argument("--workers", type=int, default=4, help="Local worker processes for --queue")
+    parser.add_argument("--output", default="llm_ranking_report.pdf", help="PDF report file")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="Finish each domain within this many seconds, reporting whatever was covered")
+    parser.add_argument("--record", default=None, metavar="CASSETTE",
+                        help="Record every crawl and provider call to this cassette")
+    parser.add_argument("--replay", default=None, metavar="CASSETTE",
+                        help="Answer crawl and provider calls from this cassette, with no network")
+    parser.add_argument("--replay-latency", choices=["recorded", "zero"], default="recorded",
+                        help="Replay calls at their recorded latency or instantly")
+    parser.add_argument("--profile", nargs="?", const="profiles", default=None, metavar="DIR",
+                        help="Profile each stage, writing collapsed stacks and allocation tables under DIR")
+    parser.add_argument("--profile-rate", type=float, default=1.0,
+                        help="Fraction of runs to profile when --profile is set")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="Also write tracemalloc top-allocation tables per stage (slows the run down a lot)")
+    args = parser.parse_args()
+    if args.record and args.replay:
+        parser.error("--record and --replay can't be used together")
+    if (args.record or args.replay) and args.queue:
+        parser.error("Cassettes don't cover queue worker processes, drop --queue to record or replay")
+    if args.queue and args.pack_size and args.pack_size > 1:
+        parser.error("Queue workers don't pack prompts, drop --pack-size to use --queue")
     
-    # Run the main async function
-    asyncio.run(main(domain))
\ No newline at end of file
+    if args.plan:
+        plan = plan_run(args.domains, top_k=args.top_k, prompts_per_keyword=args.prompts_per_keyword,
+                        pack_size=args.pack_size, structured=args.structured, archive_file=args.archive,
+                        queue_workers=args.workers if args.queue else None)
+        print(format_plan(plan))
+    else:
+        import contextlib
+        from cassette import Cassette
+
+        cassette = None
+        if args.record:
+            cassette = Cassette(args.record, mode="record")
+        elif args.replay:
+            cassette = Cassette(args.replay, mode="replay", latency=args.replay_latency)
+
+        with cassette or contextlib.nullcontext():
+            for target in args.domains:
+                # One report per domain when running a batch
+                output_file = args.output
+                if len(args.domains) > 1:
+                    output_file = f"{registrable_domain(target).split('.')[0]}_{args.output}"
+
+                print(f"Starting LLM ranking analysis for: {target}")
+                print("=" * 50)
+
+                options = dict(pack_size=args.pack_size, structured=args.structured, aliases=args.alias,
+                               top_k=args.top_k, prompts_per_keyword=args.prompts_per_keyword,
+                               deadline_seconds=args.deadline)
+                run = cassette.record_run(target, options) if args.record else None
+
+                # One run directory per profiled domain
+                profile_dir = None
+                if args.profile and random.random() < args.profile_rate:
+                    run_name = f"{time.strftime('%Y%m%d-%H%M%S')}_{registrable_domain(target).split('.')[0]}"
+                    profile_dir = os.path.join(args.profile, run_name)
+
+                # Run the main async function
+                # Replayed responses aren't new data, keep them out of the archive
+                archive_file = None if args.replay else args.archive
+                result = asyncio.run(main(target, output_file=output_file, archive_file=archive_file,
+                                          queue_file=args.queue, workers=args.workers, profile_dir=profile_dir,
+                                          profile_memory=args.profile_memory, **options))
+                if args.record:
+                    cassette.record_outcome(run, result["results"])
@@ -0,0 +1,90 @@
+import json
+from typing import Dict, List, Union
+
+from llms import TOOL_SCHEMA, normalize_tool_records
+
+
+# System prompt for packed calls, shared by every query in the pack
+PACKED_SYSTEM_PROMPT = """
+You are a helpful assistant that recommends software tools and solutions.
+You will be given several independent search queries, each with a numeric id.
+Answer each query on its own as if it were the only one you were asked, with 5-10 tools per query in order of recommendation.
+For each tool, include the name of the tool, a brief description (1-2 sentences) and the website URL if you know it.
+Return one answer per query id. Do not include any disclaimers or additional commentary.
+"""
+
+# JSON schema for a packed response: one independent tool list per query id
+PACKED_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "answers": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "query_id": {"type": "integer"},
+                    "tools": {"type": "array", "items": TOOL_SCHEMA}
+                },
+                "required": ["query_id", "tools"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["answers"],
+    "additionalProperties": False
+}
+
+
+def build_packed_prompt(prompts: List[str]) -> str:
+    """
+    Build a single user prompt that asks for answers to several queries.
+
+    Args:
+        prompts: Search prompts to pack into one call
+
+    Returns:
+        Prompt text with each query numbered by its query id
+    """
+    lines = [f"Answer each of the following {len(prompts)} queries independently:", ""]
+    for i, prompt in enumerate(prompts):
+        lines.append(f"Query {i}: {prompt}")
+    return "\n".join(lines)
+
+
+def unpack_packed_response(response_text: str, prompts: List[str]) -> Dict[str, Union[List[Dict[str, str]], None]]:
+    """
+    Validate a packed response and split it back into per-prompt tool lists.
+
+    Args:
+        response_text: Raw JSON text returned for the packed call
+        prompts: The prompts that were packed, in query id order
+
+    Returns:
+        Dictionary mapping each prompt to its list of tools, or to None when
+        that prompt's answer was missing or failed validation
+    """
+    unpacked = {prompt: None for prompt in prompts}
+
+    try:
+        data = json.loads(response_text)
+    except (TypeError, ValueError):
+        return unpacked
+
+    answers = data.get("answers") if isinstance(data, dict) else None
+    if not isinstance(answers, list):
+        return unpacked
+
+    for answer in answers:
+        if not isinstance(answer, dict):
+            continue
+        query_id = answer.get("query_id")
+        if not isinstance(query_id, int) or not 0 <= query_id < len(prompts):
+            continue
+        prompt = prompts[query_id]
+        # The first answer for a query id wins
+        if unpacked[prompt] is not None:
+            continue
+        # An empty list counts as a failed answer so it gets retried on its own
+        unpacked[prompt] = normalize_tool_records(answer.get("tools")) or None
+
+    return unpacked
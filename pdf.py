@@ -1,8 +1,20 @@
 from fpdf import FPDF
+import matplotlib
+# Charts are only saved to files, and may be drawn outside the main thread
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import os
+import tempfile
+import threading
 import numpy as np
 from datetime import datetime
+from records import MentionStatus, as_result
+from analytics import (UNKNOWN_KEYWORD, answered_counts, build_rank_tensor, keyword_table, mean_reciprocal_rank,
+                       mention_rate)
+
+# pyplot keeps global state, so reports rendered from several threads
+# (see service.py) draw their charts one at a time
+_PLOT_LOCK = threading.Lock()
 
 class PDF(FPDF):
     def header(self):
@@ -27,7 +39,7 @@ class PDF(FPDF):
         # Date
         self.cell(-40, 10, datetime.now().strftime("%Y-%m-%d"), 0, 0, 'R')
 
-def generate_pdf_report(rankings, domain, keywords, output_file="llm_ranking_report.pdf"):
+def generate_pdf_report(rankings, domain, keywords, output_file="llm_ranking_report.pdf", coverage_notes=None):
     """
     Generate a very simple PDF report that avoids encoding issues.
     
@@ -36,6 +48,8 @@ def generate_pdf_report(rankings, domain, keywords, output_file="llm_ranking_rep
         domain: The domain that was analyzed
         keywords: List of keywords that were extracted
         output_file: Output PDF filename
+        coverage_notes: Coverage gaps from a run deadline (see deadline.py).
+            When given, the report is marked as partial and lists them.
     """
     pdf = FPDF()
     pdf.add_page()
@@ -65,6 +79,16 @@ def generate_pdf_report(rankings, domain, keywords, output_file="llm_ranking_rep
     keywords_text = ", ".join([k for k in keywords if isinstance(k, str)][:10])
     pdf.multi_cell(0, 5, keywords_text)
     pdf.ln(5)
+
+    # Coverage gaps when the run hit its deadline
+    if coverage_notes:
+        pdf.set_font("Arial", "B", 12)
+        pdf.cell(0, 10, "Partial Report - Coverage Gaps:", ln=True)
+        pdf.set_font("Arial", "", 10)
+        for note in coverage_notes:
+            pdf.multi_cell(0, 5, f"- {note}")
+        pdf.multi_cell(0, 5, "Rates below only count queries that were answered before the deadline.")
+        pdf.ln(5)
     
     # Summary for each LLM
     for llm_name, prompts_data in rankings.items():
@@ -76,22 +100,33 @@ def generate_pdf_report(rankings, domain, keywords, output_file="llm_ranking_rep
         total_queries = len(prompts_data)
         mentioned = 0
         top_ranked = 0
+        packed = 0
+        skipped = 0
         
         for data in prompts_data.values():
-            rank = data.get("rank", "Error")
-            if rank != "Not mentioned" and "Error" not in str(rank):
+            result = as_result(data)
+            if result.status is MentionStatus.SKIPPED:
+                skipped += 1
+            if result.is_mentioned:
                 mentioned += 1
-            if isinstance(rank, int) and rank <= 3:
+            if result.is_top(3):
                 top_ranked += 1
+            if result.packed:
+                packed += 1
         
         # Show stats
         pdf.set_font("Arial", "", 10)
         pdf.cell(0, 8, f"Total Queries: {total_queries}", ln=True)
+        if skipped:
+            pdf.cell(0, 8, f"Skipped at Deadline: {skipped} ({total_queries - skipped} answered)", ln=True)
+        if packed:
+            pdf.cell(0, 8, f"Packed Queries: {packed} (answered several per call)", ln=True)
         pdf.cell(0, 8, f"Times Mentioned: {mentioned}", ln=True)
         pdf.cell(0, 8, f"Top 3 Rankings: {top_ranked}", ln=True)
         
-        mention_rate = (mentioned / total_queries * 100) if total_queries > 0 else 0
-        top_rate = (top_ranked / total_queries * 100) if total_queries > 0 else 0
+        answered = total_queries - skipped
+        mention_rate = (mentioned / answered * 100) if answered > 0 else 0
+        top_rate = (top_ranked / answered * 100) if answered > 0 else 0
         
         pdf.cell(0, 8, f"Mention Rate: {mention_rate:.1f}%", ln=True)
         pdf.cell(0, 8, f"Top 3 Rate: {top_rate:.1f}%", ln=True)
@@ -106,8 +141,10 @@ def generate_pdf_report(rankings, domain, keywords, output_file="llm_ranking_rep
             safe_prompt = prompt[:50] + "..." if len(prompt) > 50 else prompt
             safe_prompt = "".join(c for c in safe_prompt if c.isalnum() or c in " .,?!-")
             
-            rank = data.get("rank", "Error")
-            rank_display = f"#{rank}" if isinstance(rank, int) else str(rank)
+            result = as_result(data)
+            rank_display = f"#{result.position}" if result.status is MentionStatus.RANKED else result.status.value
+            if result.packed:
+                rank_display += " (packed)"
             
             pdf.set_font("Arial", "B", 10)
             pdf.multi_cell(0, 6, f"Query: {safe_prompt}")
@@ -125,24 +162,64 @@ def generate_pdf_report(rankings, domain, keywords, output_file="llm_ranking_rep
     total_overall = 0
     mentioned_overall = 0
     top_ranked_overall = 0
+    skipped_overall = 0
     
     for llm_name, prompts_data in rankings.items():
         total_overall += len(prompts_data)
         
         for data in prompts_data.values():
-            rank = data.get("rank", "Error")
-            if rank != "Not mentioned" and "Error" not in str(rank):
+            result = as_result(data)
+            if result.status is MentionStatus.SKIPPED:
+                skipped_overall += 1
+            if result.is_mentioned:
                 mentioned_overall += 1
-            if isinstance(rank, int) and rank <= 3:
+            if result.is_top(3):
                 top_ranked_overall += 1
     
-    overall_mention_rate = (mentioned_overall / total_overall * 100) if total_overall > 0 else 0
-    overall_top_rate = (top_ranked_overall / total_overall * 100) if total_overall > 0 else 0
+    answered_overall = total_overall - skipped_overall
+    overall_mention_rate = (mentioned_overall / answered_overall * 100) if answered_overall > 0 else 0
+    overall_top_rate = (top_ranked_overall / answered_overall * 100) if answered_overall > 0 else 0
     
     pdf.set_font("Arial", "", 10)
     pdf.cell(0, 8, f"Total Queries: {total_overall}", ln=True)
+    if skipped_overall:
+        coverage = answered_overall / total_overall * 100
+        pdf.cell(0, 8, f"Coverage: {answered_overall} of {total_overall} queries answered ({coverage:.1f}%)", ln=True)
     pdf.cell(0, 8, f"Overall Mention Rate: {overall_mention_rate:.1f}%", ln=True)
     pdf.cell(0, 8, f"Overall Top 3 Rate: {overall_top_rate:.1f}%", ln=True)
+
+    # Keyword x provider breakdown, when the prompts carry their keywords
+    tensor = build_rank_tensor(rankings, keywords)
+    keyword_counts = answered_counts(tensor, ("keyword",))
+    if any(count for keyword, count in zip(tensor.keywords, keyword_counts) if keyword != UNKNOWN_KEYWORD):
+        pdf.add_page()
+        pdf.set_font("Arial", "B", 14)
+        pdf.cell(0, 10, "Keyword Analytics", ln=True)
+
+        heatmap_file = generate_heatmaps(tensor, clean_domain)
+        try:
+            # The image is read in here, so the file can go right away
+            pdf.image(heatmap_file, w=190)
+        finally:
+            os.remove(heatmap_file)
+        pdf.ln(5)
+
+        pdf.set_font("Arial", "B", 10)
+        pdf.cell(80, 6, "Keyword")
+        pdf.cell(25, 6, "Queries")
+        pdf.cell(30, 6, "Mention Rate")
+        pdf.cell(25, 6, "MRR")
+        pdf.cell(30, 6, "Top 3 Rate", ln=True)
+        pdf.set_font("Arial", "", 10)
+        for row in keyword_table(tensor):
+            if row["queries"] == 0:
+                continue
+            safe_keyword = "".join(c for c in str(row["keyword"])[:40] if c.isalnum() or c in " .,?!-")
+            pdf.cell(80, 6, safe_keyword)
+            pdf.cell(25, 6, str(row["queries"]))
+            pdf.cell(30, 6, f"{row['mention_rate']:.1f}%")
+            pdf.cell(25, 6, f"{row['mrr']:.3f}")
+            pdf.cell(30, 6, f"{row['top_rate']:.1f}%", ln=True)
     
     # Save the report
     try:
@@ -159,7 +236,12 @@ def generate_pdf_report(rankings, domain, keywords, output_file="llm_ranking_rep
             return None
 
 def summarize_rankings(rankings):
-    """Generate summary statistics from rankings data."""
+    """
+    Generate summary statistics from rankings data.
+
+    Like the PDF report, rates are over the answered queries, leaving out
+    the ones skipped at the deadline.
+    """
     summary = {
         "total_queries": 0,
         "mentions_by_llm": {},
@@ -173,30 +255,41 @@ def summarize_rankings(rankings):
         mentioned_count = 0
         top_rankings = 0
         not_mentioned = 0
+        packed = 0
+        skipped = 0
         
         # Process each prompt
         for prompt, data in prompts_data.items():
-            rank = data["rank"]
+            result = as_result(data)
+            if result.status is MentionStatus.SKIPPED:
+                skipped += 1
+            if result.packed:
+                packed += 1
             
-            if isinstance(rank, int):
+            if result.status is MentionStatus.RANKED:
                 mentioned_count += 1
-                if rank <= 3:  # Considered a top ranking (position 1-3)
+                if result.position <= 3:  # Considered a top ranking (position 1-3)
                     top_rankings += 1
-            elif rank == "Mentioned (unranked)":
+            elif result.status is MentionStatus.MENTIONED_UNRANKED:
                 mentioned_count += 1
-            elif rank == "Not mentioned":
+            elif result.status is MentionStatus.NOT_MENTIONED:
                 not_mentioned += 1
         
         # Store in summary
+        answered = total_queries - skipped
         summary["total_queries"] += total_queries
         summary["mentions_by_llm"][llm_name] = {
             "total": total_queries,
+            "skipped": skipped,
             "mentioned": mentioned_count,
             "top_ranked": top_rankings,
             "not_mentioned": not_mentioned,
-            "mention_rate": round(mentioned_count / total_queries * 100, 1) if total_queries > 0 else 0,
-            "top_rate": round(top_rankings / total_queries * 100, 1) if total_queries > 0 else 0
+            "packed": packed,
+            "mention_rate": round(mentioned_count / answered * 100, 1) if answered > 0 else 0,
+            "top_rate": round(top_rankings / answered * 100, 1) if answered > 0 else 0
         }
+
+    summary["by_keyword"] = keyword_table(build_rank_tensor(rankings))
     
     return summary
 
@@ -242,6 +335,43 @@ def generate_charts(summary_data, domain, filename="temp_chart.png"):
     
     return filename
 
+def generate_heatmaps(tensor, domain, filename=None):
+    """
+    Render keyword x provider heatmaps of mention rate and mean reciprocal rank.
+
+    Without a filename the PNG goes to a new temporary file, which the
+    caller removes.
+    """
+    if filename is None:
+        fd, filename = tempfile.mkstemp(prefix="heatmap_", suffix=".png")
+        os.close(fd)
+    by = ("keyword", "provider")
+    panels = [
+        ("Mention Rate (%)", mention_rate(tensor, by) * 100, 100, "{:.0f}"),
+        ("Mean Reciprocal Rank", mean_reciprocal_rank(tensor, by), 1, "{:.2f}"),
+    ]
+    with _PLOT_LOCK:
+        height = max(3, 0.4 * len(tensor.keywords) + 1.5)
+        fig, axes = plt.subplots(1, len(panels), figsize=(12, height))
+
+        for ax, (title, values, vmax, fmt) in zip(axes, panels):
+            image = ax.imshow(np.ma.masked_invalid(values), cmap="YlGn", vmin=0, vmax=vmax, aspect="auto")
+            ax.set_title(f"{title} for {domain}")
+            ax.set_xticks(range(len(tensor.providers)))
+            ax.set_xticklabels([provider.upper() for provider in tensor.providers])
+            ax.set_yticks(range(len(tensor.keywords)))
+            ax.set_yticklabels([str(keyword)[:30] for keyword in tensor.keywords])
+            for (row, col), value in np.ndenumerate(values):
+                if not np.isnan(value):
+                    ax.text(col, row, fmt.format(value), ha="center", va="center", fontsize=8)
+            fig.colorbar(image, ax=ax)
+
+        plt.tight_layout()
+        plt.savefig(filename, dpi=150, bbox_inches='tight')
+        plt.close(fig)
+
+    return filename
+
 def generate_summary_text(summary_data, domain):
     """Generate executive summary text based on the data."""
     llm_names = list(summary_data["mentions_by_llm"].keys())
@@ -308,8 +438,9 @@ def create_simple_report(rankings, domain, keywords, output_file="simple_report.
         
         # Count mentions
         total_queries = len(prompts_data)
-        mentioned = sum(1 for data in prompts_data.values() if data["rank"] != "Not mentioned" and "Error" not in data["rank"])
-        top_ranked = sum(1 for data in prompts_data.values() if isinstance(data["rank"], int) and data["rank"] <= 3)
+        results = [as_result(data) for data in prompts_data.values()]
+        mentioned = sum(1 for result in results if result.is_mentioned)
+        top_ranked = sum(1 for result in results if result.is_top(3))
         
         pdf.set_font("Arial", "", 10)
         pdf.cell(0, 6, f"Total Queries: {total_queries}", ln=True)
@@ -0,0 +1,264 @@
+import math
+import os
+import statistics
+from typing import Any, Dict, Iterable, List, Union
+
+from archive import ResponseArchive, archive_paths
+from ranking import LLMS, build_request
+from summary import BRIEF_CACHE_DIR, BRIEF_TOKENS, SUMMARY_INPUT_TOKENS, content_hash
+from tokens import (DEFAULT_MODELS, KEYWORD_INPUT_TOKENS, MAX_CONCURRENT_QUERIES, count_tokens,
+                    get_tpm_limit)
+
+
+# Approximate list prices in USD per million (input, output) tokens.
+# Check these against the providers' pricing pages before relying on them.
+PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "claude-3-haiku-20240307": (0.25, 1.25),
+    "sonar-medium-online": (1.00, 1.00),
+}
+
+# Defaults used when the archive has no history for a provider yet
+DEFAULT_LATENCY = {
+    "summary": 10.0,
+    "keywords": 3.0,
+    "prompts": 4.0,
+    "ranking": 8.0,
+}
+DEFAULT_OUTPUT_TOKENS = {
+    "summary": BRIEF_TOKENS,
+    "keywords": 60,
+    "prompts_per_query": 25,
+    "ranking": 600,
+}
+
+# A typical generated search prompt, used to size ranking calls before the
+# prompts exist
+SAMPLE_QUERY = "What are the best serverless Postgres databases for a small startup building a SaaS app?"
+
+# How many recent archive records to read latency and token stats from
+HISTORY_RECORDS = 500
+
+
+def load_history(archive_file: Union[str, Iterable[str]],
+                 limit: int = HISTORY_RECORDS) -> Dict[str, Dict[str, float]]:
+    """
+    Mean latency and output tokens per provider from the most recent archive records.
+
+    archive_file can be a path, glob pattern or list of them; the worker
+    shards next to a plain path are read too. Packed calls and failed calls
+    ("Error: ..." responses) are left out, as their latency says little
+    about a normal ranking call.
+
+    Returns:
+        Dictionary mapping provider to {"latency", "output_tokens", "samples"}
+    """
+    if not archive_file:
+        return {}
+
+    records = []
+    for path in archive_paths(archive_file):
+        records.extend(ResponseArchive(path)[-limit:])
+    records.sort(key=lambda record: record.get("ts") or "")
+
+    samples = {}
+    for record in records[-limit:]:
+        if record.get("latency") is None or record.get("packed") or "Error:" in str(record.get("response")):
+            continue
+        stats = samples.setdefault(record["llm"], {"latency": [], "output_tokens": []})
+        stats["latency"].append(record["latency"])
+        stats["output_tokens"].append(record.get("output_tokens") or 0)
+
+    return {
+        llm_name: {
+            "latency": statistics.mean(stats["latency"]),
+            "output_tokens": statistics.mean(stats["output_tokens"]),
+            "samples": len(stats["latency"]),
+        }
+        for llm_name, stats in samples.items()
+    }
+
+
+def _cost(provider: str, input_tokens: float, output_tokens: float) -> float:
+    input_price, output_price = PRICES.get(DEFAULT_MODELS.get(provider), (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def plan_run(domains: List[str], top_k: int = 10, prompts_per_keyword: int = 3, providers: List[str] = None,
+             pack_size: int = None, structured: bool = False, archive_file: str = None,
+             site_content: Dict[str, str] = None, queue_workers: int = None) -> Dict[str, Any]:
+    """
+    Work out the call graph of a run (or a batch of domains) without making any paid calls.
+
+    Args:
+        domains: Domains the batch will analyze
+        top_k: Keywords extracted per domain
+        prompts_per_keyword: Search prompts generated per keyword
+        providers: Ranking providers, defaults to the enabled LLMS
+        pack_size: Packed multi-query size, if used
+        structured: Whether structured ranking output is used
+        archive_file: Response archive to take latency/token history from
+        site_content: Optional {domain: markdown} already crawled, so cached
+            briefs can be detected and the real sizes used. Without it every
+            domain is planned with a fresh summary call
+        queue_workers: Number of work queue workers, if the ranking step runs
+            through a queue. Each worker runs one call at a time
+
+    Returns:
+        Plan with per-stage calls, tokens, cost and wall-time estimates.
+        Stage times are each stage's own duration; the per-domain and total
+        wall times account for the stages that overlap
+    """
+    providers = providers or list(LLMS)
+    history = load_history(archive_file)
+    site_content = site_content or {}
+    n_prompts = top_k * prompts_per_keyword
+    concurrency = queue_workers or MAX_CONCURRENT_QUERIES
+
+    stages = []
+    domain_wall_time = {}
+
+    def add_stage(name, provider, calls, input_tokens, output_tokens, wall_time, latency_source="default"):
+        stages.append({
+            "stage": name,
+            "provider": provider,
+            "calls": calls,
+            "input_tokens": int(input_tokens),
+            "output_tokens": int(output_tokens),
+            "cost_usd": round(_cost(provider, input_tokens, output_tokens), 4),
+            "wall_time_s": round(wall_time, 1),
+            # "archive" when the time comes from load_history, "default" for DEFAULT_LATENCY
+            "latency_source": latency_source,
+        })
+
+    for domain in domains:
+        markdown = site_content.get(domain)
+
+        # Crawl
+        add_stage(f"{domain}: crawl", "firecrawl", 1, 0, 0, 0, latency_source=None)
+
+        # Site summary, skipped if a brief for this exact crawl is cached. The
+        # archive only holds ranking calls, so the summary, keyword and
+        # prompt stages always use DEFAULT_LATENCY
+        summary_calls = 1
+        summary_input = SUMMARY_INPUT_TOKENS
+        if markdown is not None:
+            summary_input = min(count_tokens(markdown), SUMMARY_INPUT_TOKENS)
+            if (os.path.exists(os.path.join(BRIEF_CACHE_DIR, f"{content_hash(markdown)}.json"))
+                    or summary_input <= BRIEF_TOKENS):
+                summary_calls = 0
+        summary_time = summary_calls * DEFAULT_LATENCY["summary"]
+        add_stage(f"{domain}: summary", "openai", summary_calls, summary_calls * summary_input,
+                  summary_calls * DEFAULT_OUTPUT_TOKENS["summary"], summary_time)
+
+        # Keyword extraction
+        keyword_input = KEYWORD_INPUT_TOKENS + 120
+        if markdown is not None:
+            keyword_input = min(count_tokens(markdown), KEYWORD_INPUT_TOKENS) + 120
+        add_stage(f"{domain}: keywords", "openai", 1, keyword_input, DEFAULT_OUTPUT_TOKENS["keywords"],
+                  DEFAULT_LATENCY["keywords"])
+
+        # Prompt generation, one call per keyword sharing the cached brief prefix
+        prompt_input = BRIEF_TOKENS + 200
+        prompt_output = DEFAULT_OUTPUT_TOKENS["prompts_per_query"] * prompts_per_keyword
+        # Keywords are handled one after another
+        prompt_time = top_k * DEFAULT_LATENCY["prompts"]
+        add_stage(f"{domain}: prompts", "openai", top_k, top_k * prompt_input, top_k * prompt_output, prompt_time)
+
+        # Ranking, all providers run at the same time
+        concurrency_times, ranking_times, call_latencies = [], [], []
+        for provider in providers:
+            stats = history.get(provider, {})
+            latency = stats.get("latency", DEFAULT_LATENCY["ranking"])
+            output_per_query = stats.get("output_tokens", DEFAULT_OUTPUT_TOKENS["ranking"])
+
+            if pack_size and pack_size > 1:
+                calls = math.ceil(n_prompts / pack_size)
+                job = tuple([SAMPLE_QUERY] * pack_size)
+            else:
+                calls = n_prompts
+                job = (SAMPLE_QUERY,)
+            system_prompt, user_prompt, _ = build_request(job, structured)
+            input_per_call = count_tokens(system_prompt, provider) + count_tokens(user_prompt, provider)
+            input_tokens = calls * input_per_call
+            output_tokens = n_prompts * output_per_query
+
+            # Either concurrency or the TPM budget is the bottleneck. Latency is
+            # dominated by output, so a packed call takes about K times longer
+            concurrency_time = math.ceil(calls / concurrency) * latency * len(job)
+            quota_time = (input_tokens + output_tokens) / get_tpm_limit(provider) * 60
+            add_stage(f"{domain}: ranking", provider, calls, input_tokens, output_tokens,
+                      max(concurrency_time, quota_time), "archive" if "latency" in stats else "default")
+            concurrency_times.append(concurrency_time)
+            ranking_times.append(max(concurrency_time, quota_time))
+            call_latencies.append(latency * len(job))
+
+        # Summary and keyword extraction run side by side after the crawl
+        analysis_time = max(summary_time, DEFAULT_LATENCY["keywords"])
+        if queue_workers:
+            # Prompts are all generated before they are queued, and the
+            # workers take jobs for every provider from the same queue
+            ranking_time = max([sum(concurrency_times)] + ranking_times)
+            domain_wall_time[domain] = analysis_time + prompt_time + ranking_time
+        else:
+            # Ranking starts on the first keyword's prompts and keeps up with
+            # generation, so the slower of the two sets the pace, plus one
+            # call of the other at the start or the end
+            ranking_time = max(ranking_times, default=0)
+            domain_wall_time[domain] = analysis_time + max(prompt_time + max(call_latencies, default=0),
+                                                           DEFAULT_LATENCY["prompts"] + ranking_time)
+
+    totals = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+    quota = {}
+    for stage in stages:
+        for key in totals:
+            totals[key] += stage[key]
+        if stage["provider"] != "firecrawl":
+            usage = quota.setdefault(stage["provider"], {"tokens": 0, "tpm_limit": get_tpm_limit(stage["provider"])})
+            usage["tokens"] += stage["input_tokens"] + stage["output_tokens"]
+    for usage in quota.values():
+        usage["quota_minutes"] = round(usage["tokens"] / usage["tpm_limit"], 1)
+    totals["cost_usd"] = round(totals["cost_usd"], 4)
+    # Domains in a batch run one after another, and the whole batch can't
+    # finish faster than the busiest provider's TPM quota allows
+    quota_time = max((usage["tokens"] / usage["tpm_limit"] * 60 for usage in quota.values()), default=0)
+    totals["wall_time_s"] = round(max(sum(domain_wall_time.values()), quota_time), 1)
+
+    return {
+        "domains": domains,
+        "stages": stages,
+        "domain_wall_time_s": {domain: round(seconds, 1) for domain, seconds in domain_wall_time.items()},
+        "totals": totals,
+        "quota_bound": quota_time > sum(domain_wall_time.values()),
+        "quota": quota,
+        "history": history,
+        "assumes_fresh_briefs": any(domain not in site_content for domain in domains),
+    }
+
+
+def format_plan(plan: Dict[str, Any]) -> str:
+    """Render a plan as a plain-text table."""
+    lines = [f"{'Stage':<40} {'Provider':<11} {'Calls':>6} {'In tok':>9} {'Out tok':>9} {'Cost $':>8} {'Time s':>8}"]
+    for stage in plan["stages"]:
+        # Mark times estimated from DEFAULT_LATENCY rather than archived calls
+        marker = "*" if stage["latency_source"] == "default" and stage["calls"] else ""
+        lines.append(f"{stage['stage'][:40]:<40} {stage['provider']:<11} {stage['calls']:>6} "
+                     f"{stage['input_tokens']:>9} {stage['output_tokens']:>9} "
+                     f"{stage['cost_usd']:>8.4f} {stage['wall_time_s']:>8.1f}{marker}")
+    totals = plan["totals"]
+    lines.append(f"{'Total':<40} {'':<11} {totals['calls']:>6} {totals['input_tokens']:>9} "
+                 f"{totals['output_tokens']:>9} {totals['cost_usd']:>8.4f} {totals['wall_time_s']:>8.1f}")
+    lines.append("")
+    for provider, usage in plan["quota"].items():
+        lines.append(f"{provider}: {usage['tokens']} tokens, {usage['quota_minutes']} min of its "
+                     f"{usage['tpm_limit']} TPM quota")
+    if plan["quota_bound"]:
+        lines.append("The total time is set by the TPM quota, not by call latency.")
+    if plan["assumes_fresh_briefs"]:
+        lines.append("Site summaries are counted for every domain, as cached briefs can't be seen before the crawl.")
+    if not plan["history"]:
+        lines.append("No latency history in the archive yet, using default latencies.")
+    if any(stage["latency_source"] == "default" and stage["calls"] for stage in plan["stages"]):
+        lines.append("* Default latency, not measured: the archive only records ranking calls, so summary, "
+                     "keyword and prompt times are always defaults.")
+    return "\n".join(lines)
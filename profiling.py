@@ -0,0 +1,182 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.01
+
+# Allocation sites listed per stage
+TOP_ALLOCATIONS = 25
+
+# Frames tracemalloc keeps per allocation. One is enough for the
+# top-allocation tables and keeps the tracing overhead down
+TRACE_FRAMES = 1
+
+# Innermost frames of a thread that is waiting rather than running
+# (network reads, idle executor threads, the event loop's select), as
+# (file, function). Samples there aren't CPU time, so they are dropped
+IDLE_FRAMES = frozenset({
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("socket.py", "readinto"),
+    ("ssl.py", "read"),
+    ("ssl.py", "recv_into"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+})
+
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    """Snapshot of the traced allocations, leaving out tracemalloc's and the profiler's own."""
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+
+
+def _frame_label(frame) -> str:
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+
+class StageProfiler:
+    """
+    Low-overhead sampling CPU profiler and allocation tracker, split by pipeline stage.
+
+    A background thread samples every thread's Python stack each
+    SAMPLE_INTERVAL and files the sample under the current stage, which
+    costs little enough to leave on. tracemalloc is much heavier (report
+    rendering runs many times slower under it), so allocation tracing is
+    opt-in with trace_allocations and snapshots are taken at every stage
+    switch. For each stage, stop() writes to output_dir:
+
+        <stage>.collapsed    folded stacks ("a;b;c count"), ready for
+                             flamegraph.pl or speedscope
+        <stage>.alloc.txt    top allocation sites during the stage, when
+                             tracing allocations (<stage>.2.alloc.txt
+                             and so on if the stage is entered again)
+
+    It also writes summary.json with the wall time, CPU samples and max
+    RSS of each stage, plus peak traced memory when tracing allocations.
+    """
+
+    def __init__(self, output_dir: str, interval: float = SAMPLE_INTERVAL, trace_allocations: bool = False,
+                 top_n: int = TOP_ALLOCATIONS):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.trace_allocations = trace_allocations
+        self.top_n = top_n
+
+        self.stage: Optional[str] = None
+        self.samples: Dict[str, Counter] = {}
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self._stage_start = None
+        self._snapshot = None
+        self._alloc_tables = Counter()  # allocation tables written per stage
+        self._started_tracemalloc = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, stage: str):
+        """Start profiling, with the first stage named `stage`."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+            self._started_tracemalloc = True
+        self._begin(stage)
+        self._thread = threading.Thread(target=self._sample_loop, name="stage-profiler", daemon=True)
+        self._thread.start()
+
+    def switch(self, stage: str):
+        """End the current stage and start the next one."""
+        self._end()
+        self._begin(stage)
+
+    def stop(self) -> str:
+        """End the last stage, write every stage's output and return the output directory."""
+        self._end()
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+        for stage, counts in self.samples.items():
+            with open(os.path.join(self.output_dir, f"{stage}.collapsed"), "w") as f:
+                for stack, count in counts.most_common():
+                    f.write(f"{stack} {count}\n")
+        with open(os.path.join(self.output_dir, "summary.json"), "w") as f:
+            json.dump(self.stats, f, indent=2)
+        return self.output_dir
+
+    def _begin(self, stage: str):
+        self.samples.setdefault(stage, Counter())
+        self.stage = stage
+        self._stage_start = time.perf_counter()
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+            self._snapshot = _take_snapshot()
+
+    def _end(self):
+        stage = self.stage
+        if stage is None:
+            return
+        self.stage = None
+        stats = self.stats.setdefault(stage, {"seconds": 0.0})
+        stats["seconds"] += time.perf_counter() - self._stage_start
+        stats["cpu_samples"] = sum(self.samples[stage].values())
+        if resource is not None:
+            # Linux reports kilobytes, macOS bytes
+            stats["max_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        if self.trace_allocations:
+            snapshot = _take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            stats["peak_traced_bytes"] = max(stats.get("peak_traced_bytes", 0), peak)
+            self._write_allocations(stage, snapshot.compare_to(self._snapshot, "lineno"))
+
+    def _write_allocations(self, stage: str, diffs: List[tracemalloc.StatisticDiff]):
+        # A stage entered more than once gets a table per entry
+        self._alloc_tables[stage] += 1
+        suffix = f".{self._alloc_tables[stage]}" if self._alloc_tables[stage] > 1 else ""
+        path = os.path.join(self.output_dir, f"{stage}{suffix}.alloc.txt")
+        with open(path, "w") as f:
+            f.write(f"{'Size diff':>12} {'Size':>12} {'Count diff':>10}  Location\n")
+            for diff in diffs[:self.top_n]:
+                frame = diff.traceback[0]
+                f.write(f"{diff.size_diff:>12} {diff.size:>12} {diff.count_diff:>10}  "
+                        f"{frame.filename}:{frame.lineno}\n")
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            stage = self.stage
+            if stage is None:
+                continue
+            counts = self.samples[stage]
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack.append(names.get(thread_id, str(thread_id)))
+                counts[";".join(reversed(stack))] += 1
@@ -0,0 +1,151 @@
+import time
+import traceback
+from functools import partial
+
+from llms import (RANKING_SCHEMA, call_claude, call_openai, call_perplexity, find_rank_in_tools,
+                  parse_claude_response, parse_openai_response, parse_perplexity_response,
+                  parse_structured_response)
+from packed import PACKED_SCHEMA, PACKED_SYSTEM_PROMPT, build_packed_prompt
+from tokens import DEFAULT_MAX_OUTPUT_TOKENS
+from records import MentionStatus, QueryResult, Tool
+from aliases import get_alias_index
+
+
+# System prompt for all LLMs
+RANKING_SYSTEM_PROMPT = """
+    You are a helpful assistant that recommends software tools and solutions.
+    When asked about tools in a certain category, provide a clear numbered list of the top options.
+    For each tool, include:
+    1. The name of the tool
+    2. A brief description (1-2 sentences)
+    3. The website URL if you know it
+    
+    Format your response as a numbered list with 5-10 items. Do not include any disclaimers or additional commentary.
+    """
+
+# System prompt for structured mode, the schema takes care of the format
+STRUCTURED_SYSTEM_PROMPT = """
+    You are a helpful assistant that recommends software tools and solutions.
+    When asked about tools in a certain category, return the top 5-10 options in order of recommendation.
+    For each tool, give its name, a brief description (1-2 sentences) and its website URL if you know it (otherwise an empty string).
+    """
+
+# Define which LLMs to use with their respective calling functions and parsers
+LLMS = {
+    "openai": {
+        "caller": call_openai,
+        "parser": parse_openai_response
+    },
+    # "claude": {
+    #     "caller": call_claude,
+    #     "parser": parse_claude_response
+    # },
+    # "perplexity": {
+    #     "caller": call_perplexity,
+    #     "parser": parse_perplexity_response
+    # }
+}
+
+# Callers for every provider, enabled or not
+CALLERS = {
+    "openai": call_openai,
+    "claude": call_claude,
+    "perplexity": call_perplexity,
+}
+
+# Response parser for each provider
+PARSERS = {
+    "openai": parse_openai_response,
+    "claude": parse_claude_response,
+    "perplexity": parse_perplexity_response,
+}
+
+
+def get_parser(llm_name, structured=False):
+    """Return the response parser for a provider, wrapped for structured output if needed."""
+    parser_func = PARSERS[llm_name]
+    if structured:
+        return partial(parse_structured_response, fallback_parser=parser_func)
+    return parser_func
+
+
+def timed_call(caller_func, *args, **kwargs):
+    """Call a provider and return (response, seconds taken)."""
+    start = time.perf_counter()
+    response = caller_func(*args, **kwargs)
+    return response, time.perf_counter() - start
+
+
+def build_request(job, structured=False):
+    """
+    Return (system_prompt, user_prompt, extra caller kwargs) for a ranking call.
+
+    Args:
+        job: Tuple of prompts answered by one call; more than one means a
+            packed call
+        structured: Whether single-prompt calls ask for structured output
+    """
+    if len(job) == 1:
+        if structured:
+            return STRUCTURED_SYSTEM_PROMPT, job[0], {"schema": RANKING_SCHEMA}
+        return RANKING_SYSTEM_PROMPT, job[0], {}
+    return (PACKED_SYSTEM_PROMPT, build_packed_prompt(list(job)),
+            {"schema": PACKED_SCHEMA, "max_tokens": DEFAULT_MAX_OUTPUT_TOKENS * len(job)})
+
+
+def build_result_entry(raw_response, parsed_tools, clean_domain, brand_name, alias_index=None):
+    """
+    Work out where the domain/brand ranks in a set of parsed tools.
+
+    alias_index is the run's AliasIndex, looked up from a shared cache when
+    not given.
+
+    Returns:
+        QueryResult for the prompt
+    """
+    # Save the raw response for reference
+    raw_response_preview = (raw_response[:500] + "..." 
+                          if len(raw_response) > 500 else raw_response)
+    
+    if alias_index is None:
+        alias_index = get_alias_index(clean_domain, brand_name)
+    
+    # Find where our domain/brand ranks in the parsed tools
+    if parsed_tools:
+        rank = find_rank_in_tools(clean_domain, brand_name, parsed_tools, alias_index=alias_index)
+    else:
+        # If parsing failed but we have a response, fall back to text search
+        if "Error:" not in raw_response:
+            # Simple text-based mention check
+            if alias_index.matches(raw_response):
+                rank = "Mentioned (parsing failed)"
+            else:
+                rank = "Not mentioned (parsing failed)"
+        else:
+            rank = "Error"
+    
+    # Keep a few parsed tools for reference (limit to 3 for brevity)
+    return QueryResult.from_rank(
+        rank,
+        response=raw_response_preview,
+        parsed_tools_count=len(parsed_tools),
+        sample_tools=tuple(Tool.from_dict(tool) for tool in parsed_tools[:3])
+    )
+
+def score_response(llm_name, prompt, raw_response, parser_func, clean_domain, brand_name, alias_index=None):
+    """Parse a raw LLM response and build its result entry."""
+    try:
+        # Parse the response to get structured tool data
+        try:
+            parsed_tools = parser_func(raw_response)
+        except Exception as e:
+            print(f"Error parsing {llm_name} response for prompt '{prompt[:30]}...': {str(e)}")
+            traceback.print_exc()
+            parsed_tools = []
+        
+        return build_result_entry(raw_response, parsed_tools, clean_domain, brand_name, alias_index)
+        
+    except Exception as e:
+        print(f"Unexpected error processing {prompt} with {llm_name}: {str(e)}")
+        traceback.print_exc()
+        return QueryResult(MentionStatus.ERROR, response=f"Error: {str(e)}")
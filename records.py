@@ -0,0 +1,179 @@
+import sys
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Dict, Optional, Tuple, Union
+
+
+class MentionStatus(Enum):
+    """How the domain/brand showed up in a response. Values are the legacy rank strings."""
+    RANKED = "Ranked"
+    MENTIONED_UNRANKED = "Mentioned (unranked)"
+    NOT_MENTIONED = "Not mentioned"
+    MENTIONED_PARSE_FAILED = "Mentioned (parsing failed)"
+    NOT_MENTIONED_PARSE_FAILED = "Not mentioned (parsing failed)"
+    ERROR = "Error"
+    SKIPPED = "Skipped (deadline)"
+
+
+MENTIONED_STATUSES = frozenset({
+    MentionStatus.RANKED,
+    MentionStatus.MENTIONED_UNRANKED,
+    MentionStatus.MENTIONED_PARSE_FAILED,
+})
+
+
+class Prompt(str):
+    """
+    A search prompt that remembers the keyword it was generated from.
+
+    Behaves exactly like the prompt string (dict keys, JSON, the work
+    queue), with the keyword along for the ride as `prompt.keyword`.
+    """
+
+    def __new__(cls, text: str, keyword: str = None):
+        prompt = super().__new__(cls, text)
+        prompt.keyword = keyword
+        return prompt
+
+
+def prompt_keyword(prompt: str) -> Optional[str]:
+    """The keyword a prompt came from, or None for a plain string."""
+    return getattr(prompt, "keyword", None)
+
+
+@dataclass(slots=True)
+class Tool:
+    """A single recommended tool parsed from a response."""
+    name: str
+    url: str = ""
+    description: str = ""
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, str]) -> "Tool":
+        # Tool names repeat across thousands of responses, so share one copy
+        return cls(sys.intern(data.get("name", "")), data.get("url", ""), data.get("description", ""))
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"name": self.name, "url": self.url, "description": self.description}
+
+
+@dataclass(slots=True)
+class QueryResult:
+    """
+    Result of one prompt against one LLM, with the keyword the prompt
+    was generated from when known.
+
+    Supports `entry["rank"]` and `entry.get("rank")` so code written
+    against the old dict entries keeps working.
+    """
+    status: MentionStatus
+    position: int = 0
+    response: str = ""
+    parsed_tools_count: int = 0
+    sample_tools: Tuple[Tool, ...] = ()
+    packed: bool = False
+    keyword: Optional[str] = None
+
+    @property
+    def rank(self) -> Union[int, str]:
+        """The legacy rank: the 1-based position if ranked, otherwise the status string."""
+        if self.status is MentionStatus.RANKED:
+            return self.position
+        return self.status.value
+
+    @property
+    def is_mentioned(self) -> bool:
+        return self.status in MENTIONED_STATUSES
+
+    def is_top(self, k: int = 3) -> bool:
+        return self.status is MentionStatus.RANKED and self.position <= k
+
+    @classmethod
+    def from_rank(cls, rank: Union[int, str], **kwargs) -> "QueryResult":
+        """Build a result from a find_rank_in_tools-style rank."""
+        if isinstance(rank, int):
+            return cls(MentionStatus.RANKED, position=rank, **kwargs)
+        return cls(MentionStatus(rank), **kwargs)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "QueryResult":
+        return cls.from_rank(
+            data.get("rank", "Error"),
+            response=data.get("response", ""),
+            parsed_tools_count=data.get("parsed_tools_count", 0),
+            sample_tools=tuple(Tool.from_dict(t) for t in data.get("sample_tools", ())),
+            packed=data.get("packed", False),
+            keyword=data.get("keyword"),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "rank": self.rank,
+            "response": self.response,
+            "parsed_tools_count": self.parsed_tools_count,
+        }
+        if self.sample_tools:
+            data["sample_tools"] = [tool.to_dict() for tool in self.sample_tools]
+        if self.packed:
+            data["packed"] = True
+        if self.keyword is not None:
+            data["keyword"] = self.keyword
+        return data
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "sample_tools":
+            if not self.sample_tools:
+                raise KeyError(key)
+            return [tool.to_dict() for tool in self.sample_tools]
+        if key == "packed":
+            if not self.packed:
+                raise KeyError(key)
+            return True
+        if key in ("rank", "response", "parsed_tools_count"):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+
+def as_result(data: Union[QueryResult, Dict[str, Any]]) -> QueryResult:
+    """Accept either a QueryResult or a legacy result dict."""
+    if isinstance(data, QueryResult):
+        return data
+    return QueryResult.from_dict(data)
+
+
+class RankingTally:
+    """Running per-LLM counts, updated as each result comes in."""
+
+    def __init__(self):
+        self.counts: Dict[str, Dict[str, int]] = {}
+
+    def add(self, llm_name: str, prompt: str, result: QueryResult):
+        """Count one result. Matches run_llm_queries' on_result callback."""
+        counts = self.counts.setdefault(llm_name, {"answered": 0, "mentioned": 0, "top_ranked": 0})
+        counts["answered"] += 1
+        if result.is_mentioned:
+            counts["mentioned"] += 1
+        if result.is_top(3):
+            counts["top_ranked"] += 1
+
+    def mention_rate(self, llm_name: str) -> float:
+        counts = self.counts.get(llm_name)
+        if not counts or not counts["answered"]:
+            return 0.0
+        return counts["mentioned"] / counts["answered"] * 100
+
+    def format(self) -> str:
+        return "\n".join(
+            f"{llm_name}: mentioned in {counts['mentioned']} of {counts['answered']} "
+            f"({self.mention_rate(llm_name):.1f}%), top 3 in {counts['top_ranked']}"
+            for llm_name, counts in self.counts.items()
+        )
@@ -0,0 +1,234 @@
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+import main as pipeline
+from archive import DEFAULT_ARCHIVE
+from pdf import summarize_rankings
+from ranking import LLMS
+from tokens import count_tokens, get_scheduler
+
+
+# Reports run side by side in one event loop; the providers' TPM budgets
+# are shared between them (tokens.get_scheduler)
+MAX_CONCURRENT_JOBS = 2
+
+REPORTS_DIR = "reports"
+
+# Options a job submission may set, with their types
+JOB_OPTIONS = {
+    "top_k": int,
+    "prompts_per_keyword": int,
+    "pack_size": int,
+    "structured": bool,
+    "aliases": list,
+    "deadline_seconds": float,
+    "max_pages": int,
+}
+
+
+class ReportService:
+    """
+    Long-running report service.
+
+    One process keeps provider clients, tokenizers, alias indexes, the site
+    brief cache and the TPM schedulers warm between reports. Jobs run on a
+    single background event loop, so concurrent reports share the same
+    rate limits.
+    """
+
+    def __init__(self, reports_dir: str = REPORTS_DIR, archive_file: str = DEFAULT_ARCHIVE,
+                 max_jobs: int = MAX_CONCURRENT_JOBS):
+        self.reports_dir = reports_dir
+        self.archive_file = archive_file
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        os.makedirs(reports_dir, exist_ok=True)
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.slots = asyncio.run_coroutine_threadsafe(self._make_semaphore(max_jobs), self.loop).result()
+        self.warm_up()
+
+    async def _make_semaphore(self, n: int) -> asyncio.Semaphore:
+        # Created on the service loop so it belongs to that loop
+        return asyncio.Semaphore(n)
+
+    def warm_up(self):
+        """Load tokenizers and build the schedulers before the first job arrives."""
+        for llm_name in LLMS:
+            count_tokens("warm up", llm_name)
+            get_scheduler(llm_name)
+
+    def submit(self, domain: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a report for a domain and return its job record."""
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            "job_id": job_id,
+            "domain": domain,
+            "options": options,
+            "status": "queued",
+            "submitted": time.time(),
+            "started": None,
+            "finished": None,
+            "error": None,
+            "report_file": None,
+            "summary": None,
+        }
+        with self.lock:
+            self.jobs[job_id] = job
+        asyncio.run_coroutine_threadsafe(self._run_job(job_id), self.loop)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Dict[str, Any]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [
+                {key: job[key] for key in ("job_id", "domain", "status", "submitted", "finished")}
+                for job in self.jobs.values()
+            ]
+
+    def _update(self, job_id: str, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    async def _run_job(self, job_id: str):
+        async with self.slots:
+            job = self.get(job_id)
+            self._update(job_id, status="running", started=time.time())
+            output_file = os.path.join(self.reports_dir, f"{job_id}.pdf")
+            try:
+                result = await pipeline.main(job["domain"], output_file=output_file,
+                                             archive_file=self.archive_file, **job["options"])
+                summary = await asyncio.to_thread(summarize_rankings, result["results"])
+                self._update(job_id, status="done", finished=time.time(),
+                             report_file=output_file if os.path.exists(output_file) else None,
+                             summary=summary)
+            except Exception as e:
+                traceback.print_exc()
+                self._update(job_id, status="failed", finished=time.time(), error=str(e))
+
+
+def parse_job_options(body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pick the known job options out of a request body.
+
+    Raises:
+        ValueError: If an option has the wrong type
+    """
+    options = {}
+    for name, kind in JOB_OPTIONS.items():
+        if body.get(name) is None:
+            continue
+        value = body[name]
+        if kind is float and isinstance(value, int):
+            value = float(value)
+        if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+            raise ValueError(f"{name} must be of type {kind.__name__}")
+        if kind is list and not all(isinstance(item, str) for item in value):
+            raise ValueError(f"{name} must be a list of strings")
+        options[name] = value
+    return options
+
+
+def make_handler(service: ReportService):
+    class Handler(BaseHTTPRequestHandler):
+        """
+        Job API:
+
+            POST /jobs               {"domain": ..., options...} -> 202 job
+            GET  /jobs               all jobs
+            GET  /jobs/<id>          job status and summary
+            GET  /jobs/<id>/report   the PDF report once done
+            GET  /health
+        """
+
+        def _send_json(self, status: int, data: Any):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parts = [part for part in self.path.split("?")[0].split("/") if part]
+            if parts == ["health"]:
+                self._send_json(200, {"status": "ok", "jobs": len(service.jobs)})
+            elif parts == ["jobs"]:
+                self._send_json(200, service.list_jobs())
+            elif len(parts) in (2, 3) and parts[0] == "jobs":
+                job = service.get(parts[1])
+                if job is None:
+                    self._send_json(404, {"error": f"Unknown job {parts[1]}"})
+                elif len(parts) == 2:
+                    self._send_json(200, job)
+                elif parts[2] != "report":
+                    self._send_json(404, {"error": f"Unknown path {self.path}"})
+                elif job["report_file"] is None:
+                    self._send_json(409, {"error": f"Report not ready, job is {job['status']}"})
+                else:
+                    with open(job["report_file"], "rb") as f:
+                        body = f.read()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/pdf")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/jobs":
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(body, dict) or not isinstance(body.get("domain"), str):
+                    raise ValueError("Body must be a JSON object with a domain")
+                options = parse_job_options(body)
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(202, service.submit(body["domain"], options))
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8000, reports_dir: str = REPORTS_DIR,
+          archive_file: str = DEFAULT_ARCHIVE, max_jobs: int = MAX_CONCURRENT_JOBS):
+    """Run the service until interrupted."""
+    service = ReportService(reports_dir, archive_file, max_jobs)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Serving report jobs on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve LLM ranking reports over a local HTTP job API.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--reports-dir", default=REPORTS_DIR, help="Where finished PDF reports are kept")
+    parser.add_argument("--archive", default=DEFAULT_ARCHIVE, help="Raw response archive")
+    parser.add_argument("--max-jobs", type=int, default=MAX_CONCURRENT_JOBS, help="Reports to run at once")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.reports_dir, args.archive, args.max_jobs)
@@ -0,0 +1,65 @@
+import hashlib
+import json
+import os
+
+from llms import call_openai
+from tokens import count_tokens, truncate_to_tokens
+
+
+# Where condensed site briefs are cached, keyed by a hash of the crawl
+BRIEF_CACHE_DIR = os.path.join(".cache", "site_briefs")
+
+# Most of the crawl we feed the summarizer, and the size of the brief it returns
+SUMMARY_INPUT_TOKENS = 12000
+BRIEF_TOKENS = 1200
+
+SUMMARY_SYSTEM_PROMPT = ("You are a product analyst who writes short, factual briefs "
+                         "describing what a company's product does and who it is for.")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def summarize_site(markdown: str, cache_dir: str = BRIEF_CACHE_DIR) -> str:
+    """
+    Condense a crawled site into a bounded domain brief, once per unique crawl.
+
+    Args:
+        markdown: Markdown text of the crawled site
+        cache_dir: Directory for cached briefs
+
+    Returns:
+        Brief of at most BRIEF_TOKENS tokens. Falls back to the truncated
+        markdown if the summary call fails.
+    """
+    digest = content_hash(markdown)
+    cache_file = os.path.join(cache_dir, f"{digest}.json")
+
+    if os.path.exists(cache_file):
+        with open(cache_file) as f:
+            return json.load(f)["brief"]
+
+    # Short sites don't need summarizing
+    if count_tokens(markdown, "openai") <= BRIEF_TOKENS:
+        return markdown
+
+    prompt = f"""
+    Below is markdown from a company's website. Write a brief of at most 600 words covering:
+    what the product is, its main features, the problems it solves, who it is for,
+    and the product categories it competes in. Use plain prose with no extra commentary.
+
+    Website:
+    {truncate_to_tokens(markdown, SUMMARY_INPUT_TOKENS, "openai")}
+    """
+
+    brief = call_openai(SUMMARY_SYSTEM_PROMPT, prompt, max_tokens=BRIEF_TOKENS)
+    if brief.startswith("Error:"):
+        print(f"Site summary failed, using truncated markdown instead: {brief}")
+        return truncate_to_tokens(markdown, BRIEF_TOKENS, "openai")
+
+    brief = truncate_to_tokens(brief.strip(), BRIEF_TOKENS, "openai")
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_file, "w") as f:
+        json.dump({"hash": digest, "brief": brief}, f)
+    return brief
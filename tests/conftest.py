@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+# The provider modules create their clients at import time
+for key in ("OPENAI_API", "ANTHROPIC_API", "PPLX_API", "FIRECRAWL_API"):
+    os.environ.setdefault(key, "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+RANKING_ANSWER = """1. **Neon** (https://neon.tech) - Serverless Postgres with branching
+2. **Supabase** (https://supabase.com) - Postgres with auth and storage
+3. **Render** (https://render.com) - Managed Postgres hosting"""
+
+
+def stub_openai_response(system_prompt, prompt, **kwargs):
+    """Canned answer for each kind of OpenAI call the pipeline makes."""
+    if "comma-separated" in prompt:
+        return "serverless postgres, database branching"
+    if "The keyword is" in prompt:
+        keyword = prompt.split("The keyword is:")[1].strip()
+        return f"1. best {keyword} for startups\n2. cheapest {keyword}"
+    return RANKING_ANSWER
+
+
+@pytest.fixture
+def stub_provider(monkeypatch):
+    """
+    Install a stand-in for call_openai everywhere it is referenced, and
+    give the TPM schedulers a budget the tests can't run into.
+
+    Returns a function taking the stand-in, defaulting to stub_openai_response.
+    """
+    import llms
+    import main
+    import ranking
+    import summary
+    import tokens
+
+    monkeypatch.setenv("OPENAI_TPM", str(10 ** 9))
+    monkeypatch.setattr(tokens, "_schedulers", {})
+
+    def install(func=stub_openai_response):
+        for module in (llms, main, ranking, summary):
+            monkeypatch.setattr(module, "call_openai", func)
+        monkeypatch.setitem(ranking.CALLERS, "openai", func)
+        monkeypatch.setitem(ranking.LLMS["openai"], "caller", func)
+        return func
+
+    return install
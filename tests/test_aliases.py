@@ -0,0 +1,57 @@
+from aliases import AliasIndex, get_alias_index, registrable_domain
+from llms import find_rank_in_tools
+
+
+def test_registrable_domain():
+    assert registrable_domain("https://www.neon.tech/docs") == "neon.tech"
+    assert registrable_domain("console.neon.tech") == "neon.tech"
+    assert registrable_domain("shop.example.co.uk") == "example.co.uk"
+    assert registrable_domain("") == ""
+
+
+def test_matches_domain_on_any_subdomain():
+    index = AliasIndex("neon.tech", "Neon")
+    assert index.matches_domain("Try https://console.neon.tech/app")
+    assert not index.matches_domain("Try https://neonatal.org")
+
+
+def test_matches_name_as_whole_words():
+    index = AliasIndex("neon.tech", "Neon", ["Neon Postgres"])
+    assert index.matches_name("Neon Postgres is serverless")
+    assert index.matches_name("I'd pick neon here")
+    assert not index.matches_name("neonatal care units")
+
+
+def test_extra_aliases():
+    index = AliasIndex("neosync.dev", "Neosync", ["nucleuscloud.com", "Nucleus Cloud"])
+    assert index.matches("Made by Nucleus Cloud")
+    assert index.matches("see nucleuscloud.com")
+    assert not index.matches("see cloud.com")
+
+
+def test_fuzzy_fallback_for_near_misses():
+    index = AliasIndex("supabase.com", "Supabase")
+    assert index.matches_name("Supabse", fuzzy=True)
+    assert index.matches_name("Supabsae", fuzzy=True)
+    assert not index.matches_name("Supabse")
+    assert not index.matches_name("Superbad", fuzzy=True)
+
+
+def test_fuzzy_fallback_skips_inflections_and_truncations():
+    assert not AliasIndex("render.com", "Render").matches_name("rendered", fuzzy=True)
+    assert not AliasIndex("render.com", "Render").matches_name("renders", fuzzy=True)
+    assert not AliasIndex("prisma.io", "Prisma").matches_name("prism", fuzzy=True)
+    assert not AliasIndex("railway.app", "Railway").matches_name("railways", fuzzy=True)
+
+
+def test_fuzzy_fallback_only_applies_to_tool_names():
+    tools = [{"name": "Vercel", "url": "https://vercel.com", "description": "Deploys and renders pages"},
+             {"name": "Rendr", "url": "", "description": ""}]
+    assert find_rank_in_tools("render.com", "Render", tools[:1]) == "Not mentioned"
+    assert find_rank_in_tools("render.com", "Render", tools) == 2
+    assert not AliasIndex("render.com", "Render").matches("Pages are rendered on the server")
+
+
+def test_get_alias_index_is_shared():
+    assert get_alias_index("neon.tech", "Neon", ["Neon Postgres"]) is get_alias_index(
+        "neon.tech", "Neon", ("Neon Postgres",))
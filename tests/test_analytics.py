@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from analytics import (UNKNOWN_KEYWORD, _reduce, build_rank_tensor, keyword_table, mean_reciprocal_rank,
+                       mention_rate, top_k_rate)
+from records import MentionStatus, Prompt, QueryResult
+
+A1 = Prompt("best postgres", "postgres")
+A2 = Prompt("cheap postgres", "postgres")
+B1 = Prompt("best auth", "auth")
+
+
+@pytest.fixture
+def rankings():
+    return {
+        "openai": {
+            A1: QueryResult(MentionStatus.RANKED, position=1),
+            A2: QueryResult(MentionStatus.RANKED, position=4),
+            B1: QueryResult(MentionStatus.NOT_MENTIONED),
+        },
+        "claude": {
+            A1: QueryResult(MentionStatus.MENTIONED_UNRANKED),
+            A2: QueryResult(MentionStatus.ERROR),
+            B1: QueryResult(MentionStatus.SKIPPED),
+        },
+    }
+
+
+def test_tensor_shape_and_masks(rankings):
+    tensor = build_rank_tensor(rankings)
+    assert tensor.keywords == ["postgres", "auth"]
+    assert tensor.providers == ["openai", "claude"]
+    assert tensor.shape == (2, 2, 2)
+    assert tensor.ranks[0, 0].tolist() == [1, 4]
+    assert tensor.valid.tolist() == [[[True, True], [True, False]], [[True, False], [False, False]]]
+    assert tensor.mentioned[0, 1, 0]
+    assert not tensor.mentioned[1, 0, 0]
+
+
+def test_keyword_order_and_plain_prompts():
+    rankings = {"openai": {"plain prompt": QueryResult(MentionStatus.RANKED, position=2), B1: {"rank": 1}}}
+    tensor = build_rank_tensor(rankings, keywords=["auth", "unused"])
+    assert tensor.keywords == ["auth", "unused", UNKNOWN_KEYWORD]
+    assert tensor.ranks[:, 0, 0].tolist() == [1, 0, 2]
+
+
+def test_rates_skip_unanswered_slots(rankings):
+    tensor = build_rank_tensor(rankings)
+    assert mention_rate(tensor).tolist() == pytest.approx([2 / 3, 1.0])
+    assert mean_reciprocal_rank(tensor).tolist() == pytest.approx([(1 + 0.25) / 3, 0.0])
+    assert top_k_rate(tensor, k=3).tolist() == pytest.approx([1 / 3, 0.0])
+
+    by_cell = mention_rate(tensor, by=("keyword", "provider"))
+    assert by_cell[0].tolist() == pytest.approx([1.0, 1.0])
+    assert by_cell[1, 0] == 0.0
+    assert np.isnan(by_cell[1, 1])
+
+
+def test_reduce_rejects_unknown_axes(rankings):
+    tensor = build_rank_tensor(rankings)
+    with pytest.raises(ValueError):
+        _reduce(tensor.mentioned, tensor.valid, ("llm",))
+
+
+def test_keyword_table(rankings):
+    table = keyword_table(build_rank_tensor(rankings))
+    assert [row["keyword"] for row in table] == ["postgres", "auth"]
+    assert table[0] == {"keyword": "postgres", "queries": 3, "mention_rate": 100.0, "mrr": 0.417, "top_rate": 33.3}
+    assert table[1]["mention_rate"] == 0.0
+
+
+def test_empty_rankings():
+    tensor = build_rank_tensor({})
+    assert tensor.shape == (0, 0, 0)
+    assert keyword_table(tensor) == []
@@ -0,0 +1,136 @@
+import multiprocessing
+import os
+
+import pytest
+
+import archive
+from archive import (ResponseArchive, archive_paths, make_record, rerank_archive, shard_path,
+                     summarize_rerank)
+
+ANSWER = """1. **Neon** (https://neon.tech) - Serverless Postgres
+2. **Supabase** (https://supabase.com) - Postgres with auth"""
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "responses.jsonl.zst")
+
+
+def fill(path, n):
+    responses = ResponseArchive(path)
+    for i in range(n):
+        responses.append(make_record("openai", (f"prompt {i}",), f"response {i}", latency=1.0 + i))
+    return responses
+
+
+def test_append_and_read_back(path):
+    responses = fill(path, 5)
+    assert len(responses) == 5
+    assert responses[0]["prompts"] == ["prompt 0"]
+    assert responses[-1]["response"] == "response 4"
+    assert [record["response"] for record in responses[1:3]] == ["response 1", "response 2"]
+    assert [record["latency"] for record in responses] == [1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+def test_index_follows_appends_from_another_handle(path):
+    reader = fill(path, 3)
+    assert len(reader) == 3
+    fill(path, 2)
+    assert len(reader) == 5
+    assert reader[4]["response"] == "response 1"
+
+
+def test_rebuild_index_after_losing_it(path):
+    fill(path, 10)
+    os.remove(path + ".idx")
+    responses = ResponseArchive(path)
+    assert len(responses) == 10
+    assert responses[9]["response"] == "response 9"
+
+
+def test_rebuild_index_stops_at_partial_frame(path, capsys):
+    fill(path, 4)
+    with open(path, "ab") as f:
+        f.write(archive._compress(b'{"cut": "short"}\n')[:6])
+    os.remove(path + ".idx")
+
+    responses = ResponseArchive(path)
+    assert len(responses) == 4
+    assert "partial frame" in capsys.readouterr().out
+
+
+def test_gzip_fallback_uses_gz_name(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "zstandard", None)
+    responses = fill(str(tmp_path / "responses.jsonl.zst"), 3)
+    assert responses.path.endswith(".jsonl.gz")
+    os.remove(responses.index_path)
+    assert len(ResponseArchive(responses.path)) == 3
+
+
+def test_rerank_archive(path):
+    responses = ResponseArchive(path)
+    for prompt in ("best postgres", "cheap postgres"):
+        responses.append(make_record("openai", (prompt,), ANSWER))
+
+    rows = list(rerank_archive(path, [("neon.tech", "Neon"), ("supabase.com", "Supabase")], workers=1))
+    assert [(row["prompt"], row["brand"], row["rank"]) for row in rows] == [
+        ("best postgres", "Neon", 1), ("best postgres", "Supabase", 2),
+        ("cheap postgres", "Neon", 1), ("cheap postgres", "Supabase", 2),
+    ]
+    summary = summarize_rerank(rows)
+    assert summary["Neon"]["openai"]["top_rate"] == 100.0
+
+
+def _append_many(path, worker, n):
+    responses = ResponseArchive(path)
+    for i in range(n):
+        responses.append(make_record("openai", (f"prompt {worker}.{i}",), "x" * (i * 97 % 500)))
+
+
+def test_concurrent_appends_from_several_processes(path):
+    ctx = multiprocessing.get_context("fork")
+    processes = [ctx.Process(target=_append_many, args=(path, worker, 40)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    responses = ResponseArchive(path)
+    assert responses._index_is_current()
+    prompts = [record["prompts"][0] for record in responses]
+    assert sorted(prompts) == sorted(f"prompt {worker}.{i}" for worker in range(4) for i in range(40))
+
+
+def test_unreadable_frames_are_skipped(path, capsys):
+    responses = fill(path, 3)
+    offset, length = responses._entries()[1]
+    with open(path, "r+b") as f:
+        f.seek(offset + 4)
+        f.write(b"\0" * (length - 4))
+
+    assert [record["response"] for record in responses] == ["response 0", "response 2"]
+    assert "Skipping unreadable frame" in capsys.readouterr().out
+    with pytest.raises(ValueError):
+        responses[1]
+
+
+def test_archive_paths_include_worker_shards(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    main_path = ResponseArchive("responses.jsonl.zst").path
+    shards = [shard_path("responses.jsonl.zst", "host-1a2b-0"), shard_path("responses.jsonl.zst", "host-1a2b-1")]
+    assert shards[0].startswith("responses.jsonl.host-1a2b-0.")
+    for name in [main_path, *shards, "other.jsonl.zst"]:
+        fill(name, 1)
+
+    assert archive_paths("responses.jsonl.zst") == [main_path, *shards]
+    assert archive_paths("responses.jsonl.host-*") == shards
+    assert len(archive_paths(["responses.jsonl.*", "other.jsonl.*"])) == 4
+    assert archive_paths("missing.jsonl.zst") == []
+
+
+def test_rerank_archive_reads_shards(path):
+    for shard in ("a", "b"):
+        ResponseArchive(shard_path(path, shard)).append(make_record("openai", (f"prompt {shard}",), ANSWER))
+
+    rows = list(rerank_archive(path, [("neon.tech", "Neon")], workers=1))
+    assert [(row["prompt"], row["rank"]) for row in rows] == [("prompt a", 1), ("prompt b", 1)]
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+import crawl
+import main
+from cassette import Cassette, CassetteMiss, benchmark, find_regressions, rank_table, request_key
+
+SITE = {"markdown": "# Neon\nServerless Postgres with branching, autoscaling and a generous free tier."}
+
+
+@pytest.fixture
+def recorded(tmp_path, stub_provider, monkeypatch):
+    """A cassette holding one full pipeline run against stub crawl and provider calls."""
+    def stub_scrape(domain, max_pages=5):
+        return SITE
+
+    monkeypatch.setattr(crawl, "scrape_website", stub_scrape)
+    monkeypatch.setattr(main, "scrape_website", stub_scrape)
+    stub_provider()
+
+    path = str(tmp_path / "run.cassette.zst")
+    options = {"top_k": 2, "prompts_per_keyword": 2}
+    with Cassette(path, mode="record") as cassette:
+        run = cassette.record_run("neon.tech", options)
+        result = asyncio.run(main.main("neon.tech", output_file=str(tmp_path / "report.pdf"),
+                                       archive_file=None, **options))
+        cassette.record_outcome(run, result["results"])
+    return path, result
+
+
+def test_request_key_is_stable():
+    assert request_key("call_openai", ("a", "b"), {"max_tokens": 5}) == \
+        request_key("call_openai", ("a", "b"), {"max_tokens": 5})
+    assert request_key("call_openai", ("a", "b"), {}) != request_key("call_openai", ("a", "c"), {})
+
+
+def test_replay_reproduces_the_recorded_run(recorded, tmp_path, monkeypatch):
+    path, recorded_result = recorded
+
+    def offline(*args, **kwargs):
+        raise AssertionError("replay made a live call")
+
+    # Anything the cassette doesn't answer would now fail loudly
+    monkeypatch.setattr(crawl, "scrape_website", offline)
+    monkeypatch.setattr(main, "scrape_website", offline)
+
+    with Cassette(path, mode="replay", latency="zero") as cassette:
+        result = asyncio.run(main.main("neon.tech", output_file=str(tmp_path / "replay.pdf"),
+                                       archive_file=None, top_k=2, prompts_per_keyword=2))
+    assert cassette.misses == 0
+    assert rank_table(result["results"]) == rank_table(recorded_result["results"])
+    assert len(result["prompts"]) == 4
+
+
+def test_replay_bypasses_the_shared_scheduler(recorded):
+    path, _ = recorded
+    shared = main.get_scheduler
+    with Cassette(path, mode="replay"):
+        assert main.get_scheduler is not shared
+        assert main.get_scheduler("openai").available() > 10 ** 12
+    assert main.get_scheduler is shared
+
+
+def test_replay_miss_answers_like_a_failed_call(recorded):
+    path, _ = recorded
+    with Cassette(path, mode="replay", latency="zero") as cassette:
+        assert main.call_openai("system", "a prompt that was never recorded").startswith("Error: ")
+        with pytest.raises(CassetteMiss):
+            main.scrape_website("example.com")
+    assert cassette.misses == 2
+
+
+def test_replay_with_different_options_counts_misses(recorded, tmp_path):
+    path, _ = recorded
+    with Cassette(path, mode="replay", latency="zero") as cassette:
+        result = asyncio.run(main.main("neon.tech", output_file=str(tmp_path / "replay.pdf"),
+                                       archive_file=None, top_k=3, prompts_per_keyword=2))
+    assert cassette.misses > 0
+    assert result["results"]
+
+
+def test_benchmark_reports_crashed_runs(recorded, monkeypatch):
+    path, _ = recorded
+
+    async def crash(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(main, "main", crash)
+    [run] = benchmark(path, repeat=1)
+    assert run["error"] == "RuntimeError: boom"
+    assert find_regressions([run]) == ["run 0 (neon.tech): failed with RuntimeError: boom"]
+
+
+def test_benchmark_finds_no_rank_changes(recorded):
+    path, _ = recorded
+    [run] = benchmark(path, repeat=1)
+    assert run["misses"] == 0
+    assert run["rank_changes"] == []
+    assert run["queries"] == 4
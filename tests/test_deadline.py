@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+import pytest
+
+from deadline import DEFAULT_STAGE_BUDGETS, RunDeadline
+from main import run_llm_queries
+from pdf import summarize_rankings
+from records import MentionStatus, QueryResult
+
+
+def test_stage_deadlines_are_cumulative():
+    deadline = RunDeadline(100)
+    assert deadline.stage_deadline("crawl") == pytest.approx(deadline.start + 100 * DEFAULT_STAGE_BUDGETS["crawl"])
+    assert deadline.stage_deadline("summary") == pytest.approx(deadline.start + 20)
+    assert deadline.stage_deadline("ranking") <= deadline.end
+
+
+def test_run_stage_returns_the_result_in_time():
+    deadline = RunDeadline(10)
+    assert asyncio.run(deadline.run_stage("crawl", lambda: "content", fallback="fallback")) == "content"
+    assert deadline.notes == []
+
+
+def test_run_stage_falls_back_when_out_of_time():
+    deadline = RunDeadline(0.5)
+    result = asyncio.run(deadline.run_stage("crawl", time.sleep, 0.5, fallback="fallback"))
+    assert result == "fallback"
+    assert deadline.notes == ["crawl stage ran out of time, continuing with a fallback"]
+
+
+def test_ranking_marks_unanswered_prompts_skipped(stub_provider):
+    def slow(system_prompt, prompt, **kwargs):
+        time.sleep(0.3)
+        return "1. **Neon** (https://neon.tech)"
+
+    stub_provider(slow)
+    prompts = [f"prompt {i}" for i in range(40)]
+    results = asyncio.run(run_llm_queries(prompts, "neon.tech", "Neon", deadline=time.monotonic() + 0.2))
+
+    statuses = [result.status for result in results["openai"].values()]
+    assert list(results["openai"]) == prompts
+    assert statuses == [MentionStatus.SKIPPED] * len(prompts)
+
+
+def test_summary_rates_leave_out_skipped_queries():
+    rankings = {"openai": {
+        "a": QueryResult(MentionStatus.RANKED, position=1),
+        "b": QueryResult(MentionStatus.NOT_MENTIONED),
+        "c": QueryResult(MentionStatus.SKIPPED),
+        "d": QueryResult(MentionStatus.SKIPPED),
+    }}
+    stats = summarize_rankings(rankings)["mentions_by_llm"]["openai"]
+    assert stats["total"] == 4
+    assert stats["skipped"] == 2
+    assert stats["mention_rate"] == 50.0
+    assert stats["top_rate"] == 50.0
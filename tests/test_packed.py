@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+from main import run_llm_queries
+from packed import PACKED_SCHEMA, build_packed_prompt, unpack_packed_response
+
+PROMPTS = ["best postgres host", "cheapest postgres", "postgres with branching"]
+
+NEON = {"name": "Neon", "url": "https://neon.tech", "description": "Serverless Postgres"}
+
+
+def packed_answer(*answers):
+    return json.dumps({"answers": [{"query_id": i, "tools": tools} for i, tools in answers]})
+
+
+def test_build_packed_prompt_numbers_queries():
+    prompt = build_packed_prompt(PROMPTS[:2])
+    assert "Query 0: best postgres host" in prompt
+    assert "Query 1: cheapest postgres" in prompt
+
+
+def test_unpack_valid_answers():
+    unpacked = unpack_packed_response(packed_answer((1, [NEON]), (0, [NEON, NEON])), PROMPTS[:2])
+    assert unpacked == {PROMPTS[0]: [NEON, NEON], PROMPTS[1]: [NEON]}
+
+
+def test_unpack_validates_each_entry():
+    bad_tool = {"url": "https://neon.tech"}  # no name
+    response = packed_answer((0, [NEON]), (1, [bad_tool]), (2, []), (7, [NEON]))
+    unpacked = unpack_packed_response(response, PROMPTS)
+    # Only the valid answer survives; the rest come back as None to retry alone
+    assert unpacked == {PROMPTS[0]: [NEON], PROMPTS[1]: None, PROMPTS[2]: None}
+
+
+def test_unpack_keeps_the_first_answer_per_query():
+    other = {"name": "Supabase", "url": "https://supabase.com", "description": ""}
+    unpacked = unpack_packed_response(packed_answer((0, [NEON]), (0, [other])), PROMPTS[:1])
+    assert unpacked == {PROMPTS[0]: [NEON]}
+
+
+def test_unpack_invalid_json():
+    assert unpack_packed_response("not json", PROMPTS[:2]) == {PROMPTS[0]: None, PROMPTS[1]: None}
+    assert unpack_packed_response('{"answers": {}}', PROMPTS[:1]) == {PROMPTS[0]: None}
+
+
+def test_invalid_packed_answers_fall_back_to_single_calls(stub_provider):
+    calls = []
+
+    def provider(system_prompt, prompt, schema=None, **kwargs):
+        calls.append(schema is PACKED_SCHEMA)
+        if schema is PACKED_SCHEMA:
+            return packed_answer((0, [NEON]), (1, []))
+        return "1. **Neon** (https://neon.tech) - Serverless Postgres"
+
+    stub_provider(provider)
+    results = asyncio.run(run_llm_queries(PROMPTS, "neon.tech", "Neon", pack_size=3))["openai"]
+
+    assert calls == [True, False, False]
+    assert list(results) == PROMPTS
+    assert results[PROMPTS[0]].get("packed")
+    assert not results[PROMPTS[1]].get("packed")
+    assert all(entry["rank"] == 1 for entry in results.values())
@@ -0,0 +1,92 @@
+import pytest
+
+from archive import ResponseArchive, make_record, shard_path
+from planner import DEFAULT_LATENCY, format_plan, load_history, plan_run
+
+
+def test_load_history_reads_worker_shards(tmp_path):
+    path = str(tmp_path / "responses.jsonl.zst")
+    ResponseArchive(path).append(make_record("openai", ("a",), "answer", latency=2.0, output_tokens=100))
+    ResponseArchive(shard_path(path, "w-0")).append(make_record("openai", ("b",), "answer", latency=4.0,
+                                                                 output_tokens=300))
+    ResponseArchive(shard_path(path, "w-1")).append(make_record("openai", ("c",), "Error: boom", latency=60.0))
+
+    history = load_history(path)
+    assert history["openai"] == {"latency": 3.0, "output_tokens": 200, "samples": 2}
+    assert load_history(str(tmp_path / "responses.jsonl.w-*"))["openai"]["samples"] == 1
+
+
+def test_load_history_keeps_the_most_recent_records(tmp_path):
+    path = str(tmp_path / "responses.jsonl.zst")
+    for shard, latency in (("w-0", 1.0), ("w-1", 5.0)):
+        ResponseArchive(shard_path(path, shard)).append(make_record("openai", ("a",), "answer", latency=latency))
+    assert load_history(path, limit=1)["openai"]["latency"] == 5.0
+
+
+def test_load_history_without_an_archive(tmp_path):
+    assert load_history(None) == {}
+    assert load_history(str(tmp_path / "missing.jsonl.zst")) == {}
+
+
+@pytest.fixture
+def unlimited_tpm(monkeypatch):
+    for provider in ("OPENAI", "CLAUDE", "PERPLEXITY"):
+        monkeypatch.setenv(f"{provider}_TPM", str(10 ** 9))
+
+
+def test_providers_rank_concurrently(unlimited_tpm):
+    one = plan_run(["neon.tech"], top_k=2, providers=["openai"])
+    two = plan_run(["neon.tech"], top_k=2, providers=["openai", "claude"])
+    assert two["totals"]["wall_time_s"] == one["totals"]["wall_time_s"]
+    assert two["totals"]["calls"] > one["totals"]["calls"]
+
+
+def test_pipelined_wall_time(unlimited_tpm):
+    plan = plan_run(["neon.tech"], top_k=2, prompts_per_keyword=3, providers=["openai"])
+    times = {stage["stage"].split(": ")[1]: stage["wall_time_s"] for stage in plan["stages"]}
+    ranking_call = DEFAULT_LATENCY["ranking"]
+
+    # Summary alongside keywords, then prompt generation overlapping ranking
+    expected = max(times["summary"], times["keywords"]) + max(times["prompts"] + ranking_call,
+                                                              DEFAULT_LATENCY["prompts"] + times["ranking"])
+    assert plan["totals"]["wall_time_s"] == pytest.approx(expected)
+    assert plan["totals"]["wall_time_s"] < sum(times.values())
+
+
+def test_queue_workers_share_providers_and_wait_for_prompts(unlimited_tpm):
+    plan = plan_run(["neon.tech"], top_k=2, providers=["openai", "claude"], queue_workers=2)
+    times = {}
+    for stage in plan["stages"]:
+        name = stage["stage"].split(": ")[1]
+        times[name] = times.get(name, 0) + stage["wall_time_s"]
+    expected = max(times["summary"], times["keywords"]) + times["prompts"] + times["ranking"]
+    assert plan["totals"]["wall_time_s"] == pytest.approx(expected)
+
+
+def test_domains_run_one_after_another(unlimited_tpm):
+    plan = plan_run(["neon.tech", "supabase.com"], top_k=2, providers=["openai"])
+    assert plan["totals"]["wall_time_s"] == pytest.approx(sum(plan["domain_wall_time_s"].values()))
+    assert plan["domain_wall_time_s"]["neon.tech"] == plan["domain_wall_time_s"]["supabase.com"]
+
+
+def test_total_time_covers_the_tpm_quota(monkeypatch):
+    monkeypatch.setenv("OPENAI_TPM", "1000")
+    plan = plan_run(["neon.tech", "supabase.com"], top_k=2, providers=["openai"])
+    tokens = plan["quota"]["openai"]["tokens"]
+    assert plan["quota_bound"]
+    assert plan["totals"]["wall_time_s"] == pytest.approx(tokens / 1000 * 60, abs=0.1)
+    assert "set by the TPM quota" in format_plan(plan)
+
+
+def test_latency_sources(tmp_path, unlimited_tpm):
+    path = str(tmp_path / "responses.jsonl.zst")
+    ResponseArchive(path).append(make_record("openai", ("a",), "answer", latency=2.0, output_tokens=100))
+    plan = plan_run(["neon.tech"], top_k=2, providers=["openai", "claude"], archive_file=path)
+
+    sources = {(stage["stage"].split(": ")[1], stage["provider"]): stage["latency_source"] for stage in plan["stages"]}
+    assert sources[("crawl", "firecrawl")] is None
+    assert sources[("summary", "openai")] == "default"
+    assert sources[("prompts", "openai")] == "default"
+    assert sources[("ranking", "openai")] == "archive"
+    assert sources[("ranking", "claude")] == "default"
+    assert "* Default latency" in format_plan(plan)
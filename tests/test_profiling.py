@@ -0,0 +1,23 @@
+import json
+import os
+
+from profiling import StageProfiler
+
+
+def test_allocation_tables_leave_out_the_profiler(tmp_path):
+    profiler = StageProfiler(str(tmp_path), trace_allocations=True)
+    profiler.start("first")
+    kept = [bytes(1000) for _ in range(100)]
+    profiler.switch("second")
+    kept.append(bytes(1000))
+    profiler.stop()
+
+    for stage in ("first", "second"):
+        with open(os.path.join(tmp_path, f"{stage}.alloc.txt")) as f:
+            table = f.read()
+        assert "tracemalloc.py" not in table
+        assert "/profiling.py" not in table
+    assert "test_profiling.py" in open(os.path.join(tmp_path, "first.alloc.txt")).read()
+
+    with open(os.path.join(tmp_path, "summary.json")) as f:
+        assert set(json.load(f)) == {"first", "second"}
@@ -0,0 +1,53 @@
+import pytest
+
+from records import MentionStatus, QueryResult, Tool, as_result
+
+LEGACY_ENTRIES = [
+    {"rank": 2, "response": "1. A\n2. Neon", "parsed_tools_count": 2,
+     "sample_tools": [{"name": "A", "url": "a.com", "description": "first"},
+                      {"name": "Neon", "url": "neon.tech", "description": "second"}]},
+    {"rank": "Mentioned (unranked)", "response": "Neon is nice", "parsed_tools_count": 0},
+    {"rank": "Not mentioned", "response": "1. A", "parsed_tools_count": 1, "packed": True},
+    {"rank": "Mentioned (parsing failed)", "response": "Neon", "parsed_tools_count": 0},
+    {"rank": "Not mentioned (parsing failed)", "response": "", "parsed_tools_count": 0},
+    {"rank": "Error", "response": "Error: boom", "parsed_tools_count": 0},
+]
+
+
+@pytest.mark.parametrize("data", LEGACY_ENTRIES)
+def test_dict_round_trip_is_lossless(data):
+    assert QueryResult.from_dict(data).to_dict() == data
+
+
+def test_legacy_access():
+    result = QueryResult.from_dict(LEGACY_ENTRIES[0])
+    assert result["rank"] == 2
+    assert result["sample_tools"][1]["name"] == "Neon"
+    assert result.get("packed") is None
+    assert "packed" not in result
+    with pytest.raises(KeyError):
+        result["missing"]
+
+    packed = QueryResult.from_dict(LEGACY_ENTRIES[2])
+    assert packed["packed"] is True
+    assert packed.get("sample_tools", []) == []
+
+
+def test_status_helpers():
+    assert QueryResult.from_rank(3).is_top()
+    assert not QueryResult.from_rank(4).is_top()
+    assert QueryResult.from_rank("Mentioned (unranked)").is_mentioned
+    assert not QueryResult.from_rank("Not mentioned").is_mentioned
+    assert QueryResult.from_rank("Error").status is MentionStatus.ERROR
+
+
+def test_tool_from_dict_fills_missing_fields():
+    assert Tool.from_dict({"name": "Neon"}) == Tool("Neon", "", "")
+    assert Tool.from_dict({"name": "Neon", "url": "neon.tech"}).to_dict() == {
+        "name": "Neon", "url": "neon.tech", "description": ""}
+
+
+def test_as_result_accepts_both_forms():
+    result = QueryResult.from_rank(1)
+    assert as_result(result) is result
+    assert as_result({"rank": 1}).rank == 1
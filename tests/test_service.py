@@ -0,0 +1,21 @@
+import pytest
+
+from service import parse_job_options
+
+
+def test_known_options_are_picked_out():
+    body = {"domain": "neon.tech", "top_k": 5, "deadline_seconds": 60, "aliases": ["Neon Postgres"], "other": 1}
+    assert parse_job_options(body) == {"top_k": 5, "deadline_seconds": 60.0, "aliases": ["Neon Postgres"]}
+
+
+@pytest.mark.parametrize("body", [
+    {"top_k": "5"},
+    {"top_k": True},
+    {"structured": "yes"},
+    {"aliases": "Neon"},
+    {"aliases": [1]},
+    {"aliases": ["Neon", None]},
+])
+def test_wrong_types_are_rejected(body):
+    with pytest.raises(ValueError):
+        parse_job_options(body)
@@ -0,0 +1,84 @@
+import pytest
+
+import tokens
+from tokens import CHARS_PER_TOKEN, TPMScheduler, count_tokens, get_tpm_limit, truncate_to_tokens
+
+
+@pytest.fixture
+def no_tiktoken(monkeypatch):
+    monkeypatch.setattr(tokens, "tiktoken", None)
+
+
+def test_length_estimate_without_tiktoken(no_tiktoken):
+    assert count_tokens("") == 0
+    assert count_tokens("a" * 40) == 40 // CHARS_PER_TOKEN
+    # Providers without a local tokenizer are scaled up
+    assert count_tokens("a" * 400, "claude") > count_tokens("a" * 400, "openai")
+
+
+def test_truncate_to_tokens_without_tiktoken(no_tiktoken):
+    assert truncate_to_tokens("short", 100) == "short"
+    assert len(truncate_to_tokens("a" * 1000, 10)) == 10 * CHARS_PER_TOKEN
+
+
+def test_tpm_limit_env_override(monkeypatch):
+    monkeypatch.setenv("OPENAI_TPM", "1234")
+    assert get_tpm_limit("openai") == 1234
+    monkeypatch.delenv("OPENAI_TPM")
+    assert get_tpm_limit("openai") == tokens.TPM_LIMITS["openai"]
+
+
+def test_pack_takes_the_largest_set_that_fits():
+    scheduler = TPMScheduler(1000)
+    requests = [("a", 600), ("b", 300), ("c", 200), ("d", 400)]
+    batch, remaining = scheduler.pack(requests)
+    # Cheapest first fits three requests, in their original order
+    assert batch == [("b", 300), ("c", 200), ("d", 400)]
+    assert remaining == [("a", 600)]
+
+
+def test_pack_respects_max_batch():
+    batch, remaining = TPMScheduler(1000).pack([("a", 10), ("b", 20), ("c", 30)], max_batch=2)
+    assert batch == [("a", 10), ("b", 20)]
+    assert remaining == [("c", 30)]
+
+
+def test_pack_counts_reserved_tokens():
+    scheduler = TPMScheduler(1000)
+    scheduler.reserve(900)
+    batch, remaining = scheduler.pack([("a", 200), ("b", 50)])
+    assert batch == [("b", 50)]
+    assert remaining == [("a", 200)]
+
+
+def test_oversized_request_runs_alone_once_the_window_is_empty():
+    scheduler = TPMScheduler(100)
+    assert scheduler.pack([("huge", 500)]) == ([("huge", 500)], [])
+    scheduler.reserve(10)
+    assert scheduler.pack([("huge", 500)]) == ([], [("huge", 500)])
+
+
+def test_settle_replaces_the_estimate():
+    scheduler = TPMScheduler(1000)
+    entry = scheduler.reserve(800)
+    assert scheduler.available() == 200
+    scheduler.settle(entry, 300)
+    assert scheduler.used() == 300
+    assert scheduler.available() == 700
+
+
+def test_usage_expires_with_the_window():
+    scheduler = TPMScheduler(1000, window=0.0)
+    scheduler.reserve(1000)
+    assert scheduler.available() == 1000
+
+
+def test_length_estimate_when_the_tokenizer_cant_load(monkeypatch):
+    class OfflineTiktoken:
+        def encoding_for_model(self, model):
+            raise ConnectionError("no network")
+
+    monkeypatch.setattr(tokens, "tiktoken", OfflineTiktoken())
+    monkeypatch.setattr(tokens, "_encoders", {})
+    assert count_tokens("a" * 40) == 40 // CHARS_PER_TOKEN
+    assert tokens._encoders == {"gpt-4o": None}
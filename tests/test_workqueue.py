@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+import workqueue
+from records import MentionStatus, Prompt, QueryResult
+from workqueue import MAX_ATTEMPTS, WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    yield queue
+    queue.close()
+
+
+def new_run(queue, prompts=("best postgres",)):
+    run_id = queue.create_run("neon.tech", "Neon", ["postgres"])
+    queue.enqueue(run_id, ["openai"], list(prompts))
+    return run_id
+
+
+def test_enqueue_skips_duplicates(queue):
+    run_id = new_run(queue)
+    assert queue.enqueue(run_id, ["openai"], ["best postgres", "cheap postgres"]) == 1
+    assert queue.counts(run_id) == {"pending": 2}
+
+
+def test_claim_leases_each_job_once(queue):
+    new_run(queue)
+    job = queue.claim("a")
+    assert job["prompt"] == "best postgres"
+    assert queue.claim("b") is None
+
+
+def test_expired_lease_is_reclaimed(queue):
+    new_run(queue)
+    queue.claim("a", lease_seconds=-1)
+    assert queue.claim("b")["prompt"] == "best postgres"
+
+
+def test_expired_lease_on_last_attempt_fails_the_job(queue):
+    run_id = new_run(queue)
+    for _ in range(MAX_ATTEMPTS):
+        assert queue.claim("a", lease_seconds=-1) is not None
+    assert queue.claim("b") is None
+    assert queue.counts(run_id) == {"failed": 1}
+    assert queue.results(run_id)["openai"]["best postgres"].status is MentionStatus.ERROR
+
+
+def test_complete_requires_the_lease(queue):
+    run_id = new_run(queue)
+    stale = queue.claim("a", lease_seconds=-1)
+    current = queue.claim("b")
+    assert not queue.complete(stale["id"], QueryResult(MentionStatus.NOT_MENTIONED), "a")
+    assert queue.complete(current["id"], QueryResult(MentionStatus.RANKED, position=1), "b")
+    assert queue.results(run_id)["openai"]["best postgres"].position == 1
+
+
+def test_fail_retries_then_gives_up(queue):
+    run_id = new_run(queue)
+    for attempt in range(MAX_ATTEMPTS):
+        job = queue.claim("a")
+        assert queue.fail(job["id"], "Error: rate limited", "a")
+        expected = "failed" if attempt == MAX_ATTEMPTS - 1 else "pending"
+        assert queue.counts(run_id) == {expected: 1}
+    assert queue.results(run_id)["openai"]["best postgres"].response == "Error: rate limited"
+
+
+def test_results_keep_the_keyword(queue):
+    run_id = new_run(queue, [Prompt("best postgres", "postgres")])
+    job = queue.claim("a")
+    queue.complete(job["id"], QueryResult(MentionStatus.NOT_MENTIONED), "a")
+    [(prompt, result)] = queue.results(run_id)["openai"].items()
+    assert prompt.keyword == "postgres"
+    assert result.keyword == "postgres"
+
+
+def test_worker_retries_error_responses(queue, stub_provider, monkeypatch):
+    calls = []
+
+    def flaky(system_prompt, prompt, **kwargs):
+        calls.append(prompt)
+        return "Error: overloaded" if len(calls) == 1 else "1. **Neon** (https://neon.tech)"
+
+    monkeypatch.setitem(workqueue.CALLERS, "openai", flaky)
+    run_id = new_run(queue)
+    done = asyncio.run(workqueue._work(queue.path, "w", True, 0.01, 1.0))
+
+    assert done == 1
+    assert len(calls) == 2
+    assert queue.counts(run_id) == {"done": 1}
+    assert queue.results(run_id)["openai"]["best postgres"].status is MentionStatus.RANKED
+
+
+def test_wait_for_run_stops_when_workers_exit(queue):
+    class ExitedWorker:
+        def is_alive(self):
+            return False
+
+    run_id = new_run(queue)
+    assert not asyncio.run(queue.wait_for_run(run_id, poll_interval=0.01, workers=[ExitedWorker()]))
+
+    job = queue.claim("a")
+    queue.complete(job["id"], QueryResult(MentionStatus.NOT_MENTIONED), "a")
+    assert asyncio.run(queue.wait_for_run(run_id, poll_interval=0.01, workers=[ExitedWorker()]))
@@ -0,0 +1,244 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Any, List, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# Default model used for each provider when the caller doesn't pass one
+DEFAULT_MODELS = {
+    "openai": "gpt-4o",
+    "claude": "claude-3-haiku-20240307",
+    "perplexity": "sonar-medium-online",
+}
+
+# Tokens-per-minute budgets per provider, override with e.g. OPENAI_TPM=90000
+TPM_LIMITS = {
+    "openai": 30000,
+    "claude": 50000,
+    "perplexity": 50000,
+}
+
+# Claude and Perplexity don't ship a local tokenizer, so we count with the
+# closest tiktoken encoding and scale up a little to stay on the safe side
+TOKEN_SCALE = {
+    "openai": 1.0,
+    "claude": 1.15,
+    "perplexity": 1.05,
+}
+
+# Rough characters-per-token ratio used when tiktoken isn't installed
+CHARS_PER_TOKEN = 4
+
+# Output budget assumed for a ranking call (matches call_claude's max_tokens)
+DEFAULT_MAX_OUTPUT_TOKENS = 1024
+
+# Token budgets for the site text we send to the prompt/keyword LLM calls
+KEYWORD_INPUT_TOKENS = 1500
+PROMPT_CONTEXT_TOKENS = 6000
+
+# Cap on how many ranking calls can be in flight at once per provider
+MAX_CONCURRENT_QUERIES = 8
+
+_encoders = {}
+
+
+def _get_encoder(model):
+    """Return a cached tiktoken encoder for the model, or None without tiktoken."""
+    if tiktoken is None:
+        return None
+    if model not in _encoders:
+        try:
+            try:
+                _encoders[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encoders[model] = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # tiktoken downloads its BPE files on first use, which fails offline
+            print(f"Could not load tokenizer for {model}, estimating tokens from length: {str(e)}")
+            _encoders[model] = None
+    return _encoders[model]
+
+
+def count_tokens(text: str, provider: str = "openai", model: str = None) -> int:
+    """
+    Count the tokens a piece of text will use for a provider/model.
+
+    Args:
+        text: Text to count
+        provider: Provider name ("openai", "claude" or "perplexity")
+        model: Model name, defaults to the provider's default model
+
+    Returns:
+        Estimated token count
+    """
+    if not text:
+        return 0
+    model = model or DEFAULT_MODELS.get(provider, "gpt-4o")
+    encoder = _get_encoder(model)
+
+    if encoder is None:
+        n_tokens = math.ceil(len(text) / CHARS_PER_TOKEN)
+    else:
+        n_tokens = len(encoder.encode(text, disallowed_special=()))
+
+    return math.ceil(n_tokens * TOKEN_SCALE.get(provider, 1.0))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, provider: str = "openai", model: str = None) -> str:
+    """
+    Truncate text so it fits in max_tokens for a provider/model.
+
+    Args:
+        text: Text to truncate
+        max_tokens: Token budget for the text
+        provider: Provider name
+        model: Model name, defaults to the provider's default model
+
+    Returns:
+        The text, cut down to the token budget if needed
+    """
+    if not text:
+        return text
+    model = model or DEFAULT_MODELS.get(provider, "gpt-4o")
+    encoder = _get_encoder(model)
+    raw_budget = int(max_tokens / TOKEN_SCALE.get(provider, 1.0))
+
+    if encoder is None:
+        return text[:raw_budget * CHARS_PER_TOKEN]
+
+    tokens = encoder.encode(text, disallowed_special=())
+    if len(tokens) <= raw_budget:
+        return text
+    return encoder.decode(tokens[:raw_budget])
+
+
+def estimate_request_tokens(system_prompt: str, prompt: str, provider: str = "openai",
+                            model: str = None, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS) -> int:
+    """Estimate the total tokens (input plus worst-case output) a single call will use."""
+    return (count_tokens(system_prompt, provider, model)
+            + count_tokens(prompt, provider, model)
+            + max_output_tokens)
+
+
+def get_tpm_limit(provider: str) -> int:
+    """Return the tokens-per-minute budget for a provider, honouring <PROVIDER>_TPM env overrides."""
+    override = os.getenv(f"{provider.upper()}_TPM")
+    if override:
+        return int(override)
+    return TPM_LIMITS.get(provider, 30000)
+
+
+class TPMScheduler:
+    """
+    Sliding-window tokens-per-minute scheduler for a single provider.
+
+    Callers reserve an estimated token count before each request and settle
+    it with the actual count afterwards, so the window reflects real usage.
+    """
+
+    def __init__(self, tpm_limit: int, window: float = 60.0):
+        self.tpm_limit = tpm_limit
+        self.window = window
+        self._usage = deque()  # [timestamp, tokens] entries
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.window
+        while self._usage and self._usage[0][0] <= cutoff:
+            self._usage.popleft()
+
+    def used(self) -> int:
+        """Tokens used inside the current window."""
+        self._prune()
+        return sum(entry[1] for entry in self._usage)
+
+    def available(self) -> int:
+        """Tokens still available inside the current window."""
+        return max(self.tpm_limit - self.used(), 0)
+
+    def pack(self, requests: List[Tuple[Any, int]], max_batch: int = None,
+             in_order: bool = False) -> Tuple[List[Tuple[Any, int]], List[Tuple[Any, int]]]:
+        """
+        Pick the largest set of requests that fits in the available budget.
+
+        Taking the cheapest requests first maximises how many fit. A request
+        bigger than the whole limit is let through on its own once the window
+        is empty, otherwise it would never run.
+
+        Args:
+            requests: List of (item, estimated_tokens) tuples
+            max_batch: Optional cap on how many requests to pick
+            in_order: Take requests from the front of the list instead of
+                cheapest first, for when list order is priority order
+
+        Returns:
+            Tuple of (batch, remaining), both keeping the original order
+        """
+        budget = self.available()
+        if in_order:
+            order = list(range(len(requests)))
+        else:
+            order = sorted(range(len(requests)), key=lambda i: requests[i][1])
+
+        picked = set()
+        used = 0
+        for i in order:
+            if max_batch is not None and len(picked) >= max_batch:
+                break
+            tokens = requests[i][1]
+            if used + tokens > budget:
+                break
+            picked.add(i)
+            used += tokens
+
+        if not picked and requests and not self._usage:
+            picked.add(order[0])
+
+        batch = [req for i, req in enumerate(requests) if i in picked]
+        remaining = [req for i, req in enumerate(requests) if i not in picked]
+        return batch, remaining
+
+    def reserve(self, tokens: int) -> list:
+        """Record an estimated token spend and return the entry for settle()."""
+        entry = [time.monotonic(), tokens]
+        self._usage.append(entry)
+        return entry
+
+    def settle(self, entry: list, actual_tokens: int):
+        """Replace a reservation's estimate with the tokens actually used."""
+        entry[1] = actual_tokens
+
+    async def wait_for_capacity(self):
+        """Sleep until the oldest entry in the window expires."""
+        self._prune()
+        if not self._usage:
+            return
+        delay = self._usage[0][0] + self.window - time.monotonic()
+        await asyncio.sleep(max(delay, 0.05))
+
+    async def acquire(self, tokens: int) -> list:
+        """Wait until `tokens` fit in the window, then reserve them."""
+        while self._usage and self.used() + tokens > self.tpm_limit:
+            await self.wait_for_capacity()
+        return self.reserve(tokens)
+
+
+_schedulers = {}
+
+
+def get_scheduler(provider: str) -> TPMScheduler:
+    """
+    Return the process-wide scheduler for a provider.
+
+    Every run in the same process shares it, so back-to-back or concurrent
+    runs (a domain batch, the service) stay inside one TPM budget.
+    """
+    if provider not in _schedulers:
+        _schedulers[provider] = TPMScheduler(get_tpm_limit(provider))
+    return _schedulers[provider]
@@ -0,0 +1,396 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Any, Dict, List
+
+from aliases import get_alias_index
+from archive import ResponseArchive, make_record, shard_path
+from ranking import CALLERS, build_request, get_parser, score_response, timed_call
+from records import MentionStatus, Prompt, QueryResult, prompt_keyword
+from tokens import TPMScheduler, count_tokens, estimate_request_tokens, get_tpm_limit
+
+
+# How long a claimed job stays leased to a worker before another worker can retake it
+LEASE_SECONDS = 300
+
+# Attempts before a job is marked failed
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    domain TEXT NOT NULL,
+    brand_name TEXT NOT NULL,
+    aliases TEXT NOT NULL,
+    keywords TEXT NOT NULL,
+    structured INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL REFERENCES runs(run_id),
+    provider TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    keyword TEXT,
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    result TEXT,
+    updated REAL NOT NULL,
+    UNIQUE (run_id, provider, prompt)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until);
+"""
+
+
+class WorkQueue:
+    """
+    Durable SQLite-backed queue of (domain, provider, prompt) ranking jobs.
+
+    Jobs are leased to workers rather than removed, so a job held by a
+    worker that crashes goes back to the pool once its lease runs out.
+    The queue file can be shared by any number of worker processes on the
+    same host.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        # Queue files created before jobs recorded their keyword
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+        if "keyword" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN keyword TEXT")
+
+    def close(self):
+        self.conn.close()
+
+    def create_run(self, domain: str, brand_name: str, keywords: List[str] = (),
+                   aliases: List[str] = (), structured: bool = False) -> str:
+        """Register a run and return its id."""
+        run_id = uuid.uuid4().hex
+        self.conn.execute(
+            "INSERT INTO runs (run_id, domain, brand_name, aliases, keywords, structured, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (run_id, domain, brand_name, json.dumps(list(aliases)), json.dumps(list(keywords)),
+             int(structured), time.time())
+        )
+        return run_id
+
+    def get_run(self, run_id: str) -> Dict[str, Any]:
+        row = self.conn.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown run {run_id}")
+        run = dict(row)
+        run["aliases"] = json.loads(run["aliases"])
+        run["keywords"] = json.loads(run["keywords"])
+        run["structured"] = bool(run["structured"])
+        return run
+
+    def enqueue(self, run_id: str, providers: List[str], prompts: List[str]) -> int:
+        """
+        Add a job per (provider, prompt), skipping any already queued. Returns jobs added.
+
+        A records.Prompt's keyword is stored with its jobs and comes back with the results.
+        """
+        now = time.time()
+        rows = [(run_id, provider, str(prompt), prompt_keyword(prompt), position, now)
+                for provider in providers
+                for position, prompt in enumerate(prompts)]
+        before = self.conn.total_changes
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO jobs (run_id, provider, prompt, keyword, position, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        self.conn.execute("COMMIT")
+        return self.conn.total_changes - before
+
+    def claim(self, worker_id: str, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        """
+        Lease the next pending (or abandoned) job to a worker, or return None.
+
+        Abandoned jobs that already used up max_attempts are marked failed
+        instead of being leased again.
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = QueryResult(MentionStatus.ERROR, response="Error: lease expired on the last attempt")
+            self.conn.execute(
+                "UPDATE jobs SET status = 'failed', result = ?, lease_until = NULL, updated = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (json.dumps(result.to_dict()), now, now, max_attempts)
+            )
+            row = self.conn.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' "
+                "OR (status = 'running' AND lease_until < ? AND attempts < ?) "
+                "ORDER BY id LIMIT 1",
+                (now, max_attempts)
+            ).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, "
+                "attempts = attempts + 1, updated = ? WHERE id = ?",
+                (worker_id, now + lease_seconds, now, row["id"])
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return dict(row)
+
+    def complete(self, job_id: int, result: QueryResult, worker_id: str) -> bool:
+        """
+        Store a job's result.
+
+        Returns:
+            False if the job is no longer leased to worker_id (its lease ran
+            out and another worker took it over), in which case nothing is stored
+        """
+        cursor = self.conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, lease_until = NULL, updated = ? "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (json.dumps(result.to_dict()), time.time(), job_id, worker_id)
+        )
+        return cursor.rowcount > 0
+
+    def fail(self, job_id: int, error: str, worker_id: str, max_attempts: int = MAX_ATTEMPTS) -> bool:
+        """
+        Put a job back in the queue, or mark it failed after max_attempts.
+
+        Returns:
+            False if the job is no longer leased to worker_id, see complete
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT attempts FROM jobs WHERE id = ? AND worker = ? AND status = 'running'",
+                (job_id, worker_id)
+            ).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return False
+            if row["attempts"] >= max_attempts:
+                response = error if error.startswith("Error:") else f"Error: {error}"
+                result = QueryResult(MentionStatus.ERROR, response=response)
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'failed', result = ?, lease_until = NULL, updated = ? WHERE id = ?",
+                    (json.dumps(result.to_dict()), time.time(), job_id)
+                )
+            else:
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'pending', worker = NULL, lease_until = NULL, updated = ? WHERE id = ?",
+                    (time.time(), job_id)
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def counts(self, run_id: str = None) -> Dict[str, int]:
+        """Number of jobs per status, for one run or the whole queue."""
+        if run_id is None:
+            rows = self.conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+        else:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) AS n FROM jobs WHERE run_id = ? GROUP BY status", (run_id,)
+            )
+        return {row["status"]: row["n"] for row in rows}
+
+    def is_finished(self, run_id: str) -> bool:
+        counts = self.counts(run_id)
+        return not counts.get("pending") and not counts.get("running")
+
+    async def wait_for_run(self, run_id: str, poll_interval: float = 1.0,
+                           workers: List[multiprocessing.Process] = None) -> bool:
+        """
+        Wait until every job of a run is done or failed.
+
+        Args:
+            run_id: Run to wait for
+            poll_interval: Seconds between checks
+            workers: Optional local worker processes; stop waiting once all
+                of them have exited
+
+        Returns:
+            True if the run finished, False if the workers exited first
+        """
+        while not self.is_finished(run_id):
+            if workers and not any(process.is_alive() for process in workers):
+                # Workers exit once the queue looks drained, so give the last
+                # of them a final chance to have finished the run
+                return self.is_finished(run_id)
+            await asyncio.sleep(poll_interval)
+        return True
+
+    def results(self, run_id: str) -> Dict[str, Dict[str, QueryResult]]:
+        """
+        Reduce a run's finished jobs into results[llm][prompt], in prompt order.
+
+        Prompts come back as records.Prompt and results carry their keyword.
+        """
+        results = {}
+        rows = self.conn.execute(
+            "SELECT provider, prompt, keyword, result FROM jobs WHERE run_id = ? AND result IS NOT NULL "
+            "ORDER BY provider, position",
+            (run_id,)
+        )
+        for row in rows:
+            result = QueryResult.from_dict(json.loads(row["result"]))
+            result.keyword = result.keyword or row["keyword"]
+            results.setdefault(row["provider"], {})[Prompt(row["prompt"], row["keyword"])] = result
+        return results
+
+
+async def _work(queue_path: str, worker_id: str, stop_when_empty: bool, poll_interval: float,
+                tpm_share: float, archive_file: str = None):
+    queue = WorkQueue(queue_path)
+    archive = ResponseArchive(archive_file) if archive_file else None
+    schedulers = {}
+    processed = 0
+
+    try:
+        while True:
+            job = queue.claim(worker_id)
+            if job is None:
+                if stop_when_empty:
+                    break
+                await asyncio.sleep(poll_interval)
+                continue
+
+            provider = job["provider"]
+            prompt = job["prompt"]
+            try:
+                run = queue.get_run(job["run_id"])
+                system_prompt, user_prompt, kwargs = build_request((prompt,), run["structured"])
+
+                if provider not in schedulers:
+                    schedulers[provider] = TPMScheduler(max(int(get_tpm_limit(provider) * tpm_share), 1))
+                scheduler = schedulers[provider]
+                reservation = await scheduler.acquire(estimate_request_tokens(system_prompt, user_prompt, provider))
+
+                raw_response, latency = await asyncio.to_thread(timed_call, CALLERS[provider],
+                                                                system_prompt, user_prompt, **kwargs)
+                input_tokens = count_tokens(system_prompt, provider) + count_tokens(user_prompt, provider)
+                output_tokens = count_tokens(raw_response, provider)
+                scheduler.settle(reservation, input_tokens + output_tokens)
+                if archive is not None:
+                    archive.append(make_record(provider, (prompt,), raw_response,
+                                               structured=run["structured"], domain=run["domain"], latency=latency,
+                                               input_tokens=input_tokens, output_tokens=output_tokens))
+
+                alias_index = get_alias_index(run["domain"], run["brand_name"], run["aliases"])
+                result = score_response(provider, prompt, raw_response, get_parser(provider, run["structured"]),
+                                        run["domain"], run["brand_name"], alias_index)
+                if result.status is MentionStatus.ERROR:
+                    # Callers report failures as "Error: ..." responses, retry those
+                    raise RuntimeError(result.response)
+                result.keyword = job["keyword"]
+                if queue.complete(job["id"], result, worker_id):
+                    processed += 1
+                else:
+                    print(f"Worker {worker_id} lost the lease on job {job['id']} ({provider}), dropping its result")
+            except Exception as e:
+                print(f"Worker {worker_id} failed job {job['id']} ({provider}): {str(e)}")
+                queue.fail(job["id"], str(e), worker_id)
+    finally:
+        queue.close()
+
+    return processed
+
+
+def run_worker(queue_path: str, worker_id: str = None, stop_when_empty: bool = True,
+               poll_interval: float = 1.0, tpm_share: float = 1.0, archive_file: str = None) -> int:
+    """
+    Pull jobs from the queue until it is empty (or forever), running call -> parse -> rank for each.
+
+    Args:
+        queue_path: SQLite queue file
+        worker_id: Name recorded against leased jobs, defaults to host:pid
+        stop_when_empty: Exit once no jobs are left instead of polling
+        poll_interval: Seconds between polls of an empty queue
+        tpm_share: Fraction of each provider's TPM budget this worker may use
+        archive_file: Optional ResponseArchive path for the raw responses
+
+    Returns:
+        Number of jobs completed
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    return asyncio.run(_work(queue_path, worker_id, stop_when_empty, poll_interval, tpm_share, archive_file))
+
+
+def start_workers(queue_path: str, n_workers: int, archive_file: str = None) -> List[multiprocessing.Process]:
+    """Start n local worker processes that exit once the queue is drained."""
+    # Spawn rather than fork so each worker builds its own provider clients
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    batch = uuid.uuid4().hex[:8]
+    for i in range(n_workers):
+        # Each worker appends to its own archive shard, named after its
+        # worker id so shards of different runs never collide
+        worker_id = f"{socket.gethostname()}-{batch}-{i}"
+        worker_archive = shard_path(archive_file, worker_id) if archive_file else None
+        process = context.Process(
+            target=run_worker,
+            args=(queue_path, worker_id),
+            kwargs={"tpm_share": 1.0 / n_workers, "archive_file": worker_archive},
+            daemon=True
+        )
+        process.start()
+        processes.append(process)
+    return processes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Work queue for distributed LLM ranking sweeps.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    worker_parser = subparsers.add_parser("worker", help="Run a worker against a queue")
+    worker_parser.add_argument("queue", help="SQLite queue file")
+    worker_parser.add_argument("--forever", action="store_true", help="Keep polling when the queue is empty")
+    worker_parser.add_argument("--tpm-share", type=float, default=1.0,
+                               help="Fraction of each provider's TPM budget this worker may use")
+    worker_parser.add_argument("--archive", default=None, help="Append raw responses to this archive")
+
+    status_parser = subparsers.add_parser("status", help="Show job counts")
+    status_parser.add_argument("queue", help="SQLite queue file")
+    status_parser.add_argument("--run", default=None, help="Only count jobs for this run")
+
+    report_parser = subparsers.add_parser("report", help="Reduce a finished run into a PDF report")
+    report_parser.add_argument("queue", help="SQLite queue file")
+    report_parser.add_argument("run", help="Run id")
+    report_parser.add_argument("--output", default="llm_ranking_report.pdf", help="PDF file to write")
+
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        done = run_worker(args.queue, stop_when_empty=not args.forever, tpm_share=args.tpm_share,
+                          archive_file=args.archive)
+        print(f"Completed {done} jobs")
+    elif args.command == "status":
+        queue = WorkQueue(args.queue)
+        print(json.dumps(queue.counts(args.run), indent=2))
+    elif args.command == "report":
+        from pdf import generate_pdf_report
+
+        queue = WorkQueue(args.queue)
+        run = queue.get_run(args.run)
+        if not queue.is_finished(args.run):
+            print(f"Run {args.run} still has unfinished jobs: {queue.counts(args.run)}")
+        report_file = generate_pdf_report(queue.results(args.run), run["domain"], run["keywords"], args.output)
+        print(f"Report saved to: {report_file}")